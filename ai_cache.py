@@ -0,0 +1,118 @@
+# ai_cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+AI_CACHE_SIZE = int(os.environ.get("AI_CACHE_SIZE", 512))
+AI_CACHE_TTL = int(os.environ.get("AI_CACHE_TTL", 24 * 3600))
+# Set AI_CACHE_DIR to also keep responses on disk, shared across workers and restarts
+AI_CACHE_DIR = os.environ.get("AI_CACHE_DIR")
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so trivially different resends share a cache entry"""
+    return " ".join(prompt.split())
+
+
+class ResponseCache:
+    """LRU cache with TTL eviction and an optional on-disk tier, keyed by prompt hash + model params"""
+
+    def __init__(self, max_entries=AI_CACHE_SIZE, ttl=AI_CACHE_TTL, disk_dir=AI_CACHE_DIR):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def key(self, prompt, **params):
+        payload = json.dumps({"prompt": normalize_prompt(prompt), "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                del self.entries[key]
+
+        entry = self._disk_get(key, now)
+        if entry is None:
+            return None
+        # Keep the disk entry's expiry rather than restarting the TTL
+        self._remember(key, entry["expires_at"], entry["value"])
+        return entry["value"]
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, value)
+        self._disk_set(key, expires_at, value)
+
+    def _remember(self, key, expires_at, value):
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key, now):
+        """The unexpired {"expires_at", "value"} entry stored on disk for key, or None"""
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] <= now:
+            self._remove(self._path(key))
+            return None
+        return entry
+
+    def _disk_set(self, key, expires_at, value):
+        if not self.disk_dir:
+            return
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing AI cache entry: {str(e)}")
+            return
+
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Remove expired files from the disk tier"""
+        now = time.time()
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    expired = json.load(f)["expires_at"] <= now
+            except (OSError, ValueError, KeyError):
+                expired = True
+            if expired:
+                self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -6,21 +6,33 @@ import traceback
 import secrets
 import csv
 import io
-import requests
+import time
+import hashlib
+import tempfile
+import functools
 import smtplib
 import imaplib
 import ssl
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
-from datetime import datetime, timedelta, timezone
-from flask import Flask, request, redirect, render_template, jsonify, current_app
+from datetime import date, datetime, timedelta, timezone
+from flask import Flask, Response, request, redirect, render_template, jsonify, current_app, stream_with_context, make_response
 from dotenv import load_dotenv
 from supabase import create_client
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from email_validator import validate_email, EmailNotValidError
 from urllib.parse import urlencode
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from validation import get_validation_pool, validate_emails, VALIDATION_CHUNK_SIZE, VALIDATION_WORKERS
+from click_buffer import ClickBuffer
+from usage_buffer import UsageBuffer
+from tracking import build_link_rows, verify_token
+from utils import model_router
+from reply_service import generate_reply, stream_reply_sections
+import http_client
+from bulkhead import ai_bulkhead, BulkheadFull, overloaded_response
+from downloads import attachment_headers
 
 
 # Supabase server-side client (service role)
@@ -28,6 +40,13 @@ SUPABASE_URL = os.environ['SUPABASE_URL']
 SUPABASE_KEY = os.environ['SUPABASE_SERVICE_ROLE_KEY']
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+def apply_click_rollups(batch):
+    """Fold a flushed batch of clicks into the per-campaign rollups (sql/click_rollups.sql)"""
+    supabase.rpc("apply_click_rollups", {"clicks": batch}).execute()
+
+# Clicks are written behind the redirect in bulk
+click_buffer = ClickBuffer(supabase, on_flush=apply_click_rollups)
+
 # Encryption key (32 bytes hex)
 ENCRYPTION_KEY = bytes.fromhex(os.environ['ENCRYPTION_KEY'])
 
@@ -61,6 +80,130 @@ def render_email_template(template, lead_data):
     
     return rendered
 
+def insert_tracked_links(queued_rows):
+    """Build the link table for freshly queued emails so tracking tokens can be resolved.
+
+    Best effort: a failure is logged and queueing carries on, since the worker
+    (ensure_tracked_links) writes any missing rows before sending.
+    """
+    # Chunks end on email boundaries, so each email's links are written all or nothing;
+    # ensure_tracked_links only checks whether an email has any rows
+    chunks = [[]]
+    for q in queued_rows:
+        if len(chunks[-1]) >= 500:
+            chunks.append([])
+        chunks[-1].extend(build_link_rows(q))
+    try:
+        for chunk in chunks:
+            if chunk:
+                supabase.table("tracked_links").upsert(chunk, on_conflict="email_queue_id,link_index").execute()
+    except Exception as e:
+        print(f"Error writing tracked links for {len(queued_rows)} queued emails: {str(e)}")
+
+# Tracked links never change once queued, so lookups are cached per email
+TRACKED_LINK_CACHE_SIZE = int(os.environ.get("TRACKED_LINK_CACHE_SIZE", 10000))
+
+@functools.lru_cache(maxsize=TRACKED_LINK_CACHE_SIZE)
+def get_tracked_links(email_queue_id):
+    """Return {link_index: link row} for one queued email; misses raise so they aren't cached"""
+    links = supabase.table("tracked_links") \
+        .select("link_index, url, lead_id, campaign_id") \
+        .eq("email_queue_id", email_queue_id) \
+        .execute()
+    if not links.data:
+        raise LookupError(f"No tracked links for email {email_queue_id}")
+    return {link["link_index"]: link for link in links.data}
+
+def demo_redirect_url(lead_id, campaign_id, email_queue_id=None):
+    """Landing page that tracked links redirect to"""
+    demo_url = "https://xxxloveitxxx.github.io/tha-clone-of-admin/templates/demo6.html"
+    redirect_url = f"{demo_url}?lead_id={lead_id}&campaign_id={campaign_id}"
+    if email_queue_id:
+        redirect_url += f"&eqid={email_queue_id}"
+    return redirect_url
+
+def tracked_redirect_url(url, lead_id, campaign_id, email_queue_id):
+    """Destination for a ?url= click: url itself only if it is one of that email's tracked
+    links, otherwise the demo page, so the tracker can't be used as an open redirect"""
+    if email_queue_id:
+        try:
+            links = get_tracked_links(email_queue_id).values()
+        except LookupError:
+            links = []
+        if any(link["url"] == url and link["lead_id"] == lead_id for link in links):
+            return url
+    return demo_redirect_url(lead_id, campaign_id, email_queue_id)
+
+def click_ids(lead_id, campaign_id, email_queue_id=None):
+    """(lead_id, campaign_id, email_queue_id) from a tracking request as ints.
+
+    Raises ValueError for a malformed id, so the request is rejected instead of its
+    click failing a whole buffered batch later.
+    """
+    try:
+        return int(lead_id), int(campaign_id), int(email_queue_id) if email_queue_id else None
+    except (ValueError, TypeError):
+        raise ValueError("lead_id, campaign_id and eqid must be integers")
+
+# ---------- Response cache ----------
+# Per-process cache for read-mostly admin endpoints: name -> {path: (expires_at, generation, etag, body, mimetype)}
+response_cache = {}
+# invalidate_cache appends a byte to <name>.gen here; every worker on the host checks
+# the file's size and mtime before serving, so a write in one worker clears all of them
+CACHE_GENERATION_DIR = os.environ.get("CACHE_GENERATION_DIR", os.path.join(tempfile.gettempdir(), "response_cache"))
+os.makedirs(CACHE_GENERATION_DIR, exist_ok=True)
+
+def cache_generation(name):
+    """(size, mtime) of the cache's generation file, changed by every invalidate_cache(name)"""
+    try:
+        st = os.stat(os.path.join(CACHE_GENERATION_DIR, f"{name}.gen"))
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def cached_route(name, ttl):
+    """Cache a GET view's 200 response for ttl seconds and answer If-None-Match with 304"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            entries = response_cache.setdefault(name, {})
+            entry = entries.get(request.full_path)
+            generation = cache_generation(name)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != generation:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                entry = (time.monotonic() + ttl, generation, etag, body, response.mimetype)
+                entries[request.full_path] = entry
+
+            _, _, etag, body, mimetype = entry
+            if etag in request.if_none_match:
+                response = make_response("", 304)
+            else:
+                response = make_response(body, 200)
+                response.mimetype = mimetype
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
+
+def invalidate_cache(*names):
+    """Drop cached responses after a write to the underlying tables, in every worker"""
+    for name in names:
+        response_cache.pop(name, None)
+        path = os.path.join(CACHE_GENERATION_DIR, f"{name}.gen")
+        try:
+            # Growing the file changes its size even when the mtime doesn't tick
+            with open(path, "ab") as f:
+                if f.tell() > 4096:
+                    f.truncate(0)
+                f.write(b".")
+        except OSError as e:
+            print(f"Error invalidating {name} cache: {str(e)}")
+
 # Add this import at the top of app.py
 from flask_cors import CORS
 
@@ -94,6 +237,7 @@ def admin():
 
 # Remove Google OAuth routes and add SMTP account routes
 @app.route('/api/smtp-accounts', methods=['GET'])
+@cached_route("smtp_accounts", ttl=300)
 def api_get_smtp_accounts():
     try:
         accounts = supabase.table("smtp_accounts").select("*").execute()
@@ -103,6 +247,7 @@ def api_get_smtp_accounts():
 
 # Update the account status endpoint to use SMTP accounts
 @app.route('/api/account-status', methods=['GET'])
+@cached_route("account_status", ttl=30)
 def api_get_account_status():
     try:
         today = date.today().isoformat()
@@ -136,6 +281,7 @@ def api_get_account_status():
         return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
 
 @app.route('/api/campaigns', methods=['GET'])
+@cached_route("campaigns", ttl=120)
 def api_get_campaigns():
     try:
         campaigns = supabase.table("campaigns").select("*").order("created_at", desc=True).execute()
@@ -167,6 +313,7 @@ def api_create_campaign():
         
         campaign = result.data[0]
         campaign_id = campaign['id']
+        invalidate_cache("campaigns")
         
         # Add follow-ups if any
         if follow_ups:
@@ -207,7 +354,8 @@ def api_create_campaign():
                 CHUNK_SIZE = 100
                 for i in range(0, len(email_queue), CHUNK_SIZE):
                     chunk = email_queue[i:i+CHUNK_SIZE]
-                    supabase.table("email_queue").insert(chunk).execute()
+                    result = supabase.table("email_queue").insert(chunk).execute()
+                    insert_tracked_links(result.data)
                 
                 print(f"DEBUG: Queued {len(email_queue)} emails with scheduled_for: {datetime.now(timezone.utc).isoformat()}")
         
@@ -266,6 +414,7 @@ def api_queue_followup():
         for i in range(0, len(email_queue), CHUNK_SIZE):
             chunk = email_queue[i:i+CHUNK_SIZE]
             result = supabase.table("email_queue").insert(chunk).execute()
+            insert_tracked_links(result.data)
             total_queued += len(chunk)
         
         return jsonify({"ok": True, "queued": total_queued}), 200
@@ -275,6 +424,7 @@ def api_queue_followup():
 
 # Update the api_get_lead_lists function
 @app.route('/api/leads/lists', methods=['GET'])
+@cached_route("lead_lists", ttl=120)
 def api_get_lead_lists():
     try:
         # Get unique list names with counts using direct query instead of RPC
@@ -293,6 +443,175 @@ def api_get_lead_lists():
         app.logger.error("Error in api_get_lead_lists: %s", traceback.format_exc())
         return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
 
+# ---------- Lead import ----------
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 100))
+# Uploads larger than this get their emails validated in a process pool
+PARALLEL_VALIDATION_BYTES = int(os.environ.get("PARALLEL_VALIDATION_BYTES", 5 * 1024 * 1024))
+# Keep at most this many rejected rows in the import report
+REJECTED_REPORT_LIMIT = int(os.environ.get("REJECTED_REPORT_LIMIT", 1000))
+# Emails per in_ lookup, keeping the filter's URL short
+LEAD_LOOKUP_CHUNK = 200
+LEAD_COLUMNS = ['email', 'name', 'last_name', 'last name', 'city', 'brokerage', 'service', 'list_name']
+
+def email_digest(email):
+    """Compact 8-byte fingerprint of an email, used to dedupe without keeping every address"""
+    return hashlib.blake2b(email.encode('utf-8'), digest_size=8).digest()
+
+def build_lead_data(row, list_name):
+    """Clean a CSV row into a leads record (the email is not validated here)"""
+    cleaned_row = {}
+    for key, value in row.items():
+        if key is not None and value is not None:
+            cleaned_row[key.strip().lower()] = value.strip()
+
+    return {
+        "email": cleaned_row.get('email', '').lower(),
+        "name": cleaned_row.get('name', ''),
+        "last_name": cleaned_row.get('last_name', cleaned_row.get('last name', '')),
+        "city": cleaned_row.get('city', ''),
+        "brokerage": cleaned_row.get('brokerage', ''),
+        "service": cleaned_row.get('service', ''),
+        "list_name": list_name,
+        "custom_fields": {k: v for k, v in cleaned_row.items() if k not in LEAD_COLUMNS}
+    }
+
+def iter_validated_leads(csv_input, list_name, report, executor=None):
+    """Yield valid leads as the CSV is read, validating emails a window of rows at a time"""
+    window_size = VALIDATION_CHUNK_SIZE * (VALIDATION_WORKERS if executor else 1)
+    window = []
+
+    def reject(row_number, email, reason):
+        report["rejected_count"] += 1
+        if len(report["rejected"]) < REJECTED_REPORT_LIMIT:
+            report["rejected"].append({"row": row_number, "email": email, "reason": reason})
+
+    def flush():
+        reasons = validate_emails([lead['email'] for _, lead in window], executor)
+        for (row_number, lead_data), reason in zip(window, reasons):
+            if reason:
+                reject(row_number, lead_data['email'], reason)
+            else:
+                yield lead_data
+        window.clear()
+
+    for row_number, row in enumerate(csv_input, 1):
+        lead_data = build_lead_data(row, list_name)
+        if not lead_data['email']:
+            reject(row_number, '', "Missing email")
+            continue
+        window.append((row_number, lead_data))
+        if len(window) >= window_size:
+            yield from flush()
+
+    if window:
+        yield from flush()
+
+def iter_lead_batches(leads, batch_size):
+    """Group leads into upsert batches, deduped within each batch"""
+    pending = {}
+    for lead_data in leads:
+        # Keep only the last occurrence of each email in the batch
+        pending[lead_data['email']] = lead_data
+        if len(pending) >= batch_size:
+            yield list(pending.values())
+            pending = {}
+
+    if pending:
+        yield list(pending.values())
+
+def lead_content_hash(lead_data):
+    """Stable hash of a normalized lead, stored in leads.content_hash for delta imports"""
+    payload = json.dumps(lead_data, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+def split_changed_leads(batch):
+    """Fetch stored hashes for a batch, LEAD_LOOKUP_CHUNK emails per query, and return
+    (new, changed, unchanged_count)"""
+    emails = [lead['email'] for lead in batch]
+    stored_hashes = {}
+    for i in range(0, len(emails), LEAD_LOOKUP_CHUNK):
+        stored = supabase.table("leads") \
+            .select("email, content_hash") \
+            .in_("email", emails[i:i + LEAD_LOOKUP_CHUNK]) \
+            .execute()
+        stored_hashes.update((row['email'], row.get('content_hash')) for row in stored.data)
+
+    new_leads = []
+    changed_leads = []
+    for lead in batch:
+        if lead['email'] not in stored_hashes:
+            new_leads.append(lead)
+        elif stored_hashes[lead['email']] != lead['content_hash']:
+            changed_leads.append(lead)
+    return new_leads, changed_leads, len(batch) - len(new_leads) - len(changed_leads)
+
+def import_leads_stream(csv_input, list_name, batch_size=IMPORT_BATCH_SIZE, dedupe="exact", parallel=False, delta=False):
+    """Upsert leads batch by batch as the CSV is parsed and yield progress after each batch.
+
+    With dedupe="exact" every email is remembered as an 8-byte digest so repeats in later
+    batches are not counted twice; dedupe="window" only dedupes inside each batch and keeps
+    memory flat regardless of file size. Repeats are still upserted, so the last row wins.
+    With delta=True only rows whose content hash is new or differs from the stored one
+    are upserted, and inserted/updated/unchanged counts are reported.
+    The final record has "done" set and carries the rejected-rows report.
+    """
+    seen = set()
+    imported = 0
+    duplicates = 0
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    report = {"rejected_count": 0, "rejected": []}
+    executor = get_validation_pool() if parallel else None
+    leads = iter_validated_leads(csv_input, list_name, report, executor)
+    for batch_number, batch in enumerate(iter_lead_batches(leads, batch_size), 1):
+        for lead in batch:
+            lead['content_hash'] = lead_content_hash(lead)
+
+        if delta:
+            new_leads, changed_leads, unchanged_count = split_changed_leads(batch)
+            to_write = new_leads + changed_leads
+            counts["inserted"] += len(new_leads)
+            counts["updated"] += len(changed_leads)
+            counts["unchanged"] += unchanged_count
+        else:
+            to_write = batch
+
+        if to_write:
+            result = supabase.table("leads").upsert(to_write, on_conflict="email").execute()
+            invalidate_cache("lead_lists")
+            if getattr(result, "error", None):
+                yield {"error": "db_error", "detail": str(result.error), "batch": batch_number}
+                return
+
+        new_count = len(batch)
+        if dedupe == "exact":
+            for lead in batch:
+                digest = email_digest(lead['email'])
+                if digest in seen:
+                    new_count -= 1
+                else:
+                    seen.add(digest)
+        imported += new_count
+        duplicates += len(batch) - new_count
+
+        yield {
+            "batch": batch_number,
+            "upserted": len(to_write),
+            "imported": imported,
+            "duplicates": duplicates,
+            "rejected_count": report["rejected_count"],
+            **(counts if delta else {}),
+            "sample": batch[0]
+        }
+
+    yield {
+        "done": True,
+        "imported": imported,
+        "duplicates": duplicates,
+        **(counts if delta else {}),
+        "rejected_count": report["rejected_count"],
+        "rejected": report["rejected"]
+    }
+
 # Update the api_import_leads function with better error handling
 @app.route('/api/leads/import', methods=['POST'])
 def api_import_leads():
@@ -302,74 +621,80 @@ def api_import_leads():
         
         file = request.files['file']
         list_name = request.form.get('list_name', 'Imported List')
+        dedupe = request.form.get('dedupe', 'exact')
+        mode = request.form.get('mode', 'full')
         
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
         if not file.filename.endswith('.csv'):
             return jsonify({"error": "Only CSV files are supported"}), 400
+
+        if dedupe not in ('exact', 'window'):
+            return jsonify({"error": "dedupe must be 'exact' or 'window'"}), 400
+
+        if mode not in ('full', 'delta'):
+            return jsonify({"error": "mode must be 'full' or 'delta'"}), 400
+
+        try:
+            batch_size = int(request.form.get('batch_size', IMPORT_BATCH_SIZE))
+        except ValueError:
+            return jsonify({"error": "batch_size must be an integer"}), 400
+        batch_size = max(1, min(batch_size, 1000))
         
-        # Read and parse CSV
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
+        # Decode and parse the upload incrementally instead of reading it into memory
+        stream = io.TextIOWrapper(file.stream, encoding="utf-8", newline="")
         csv_input = csv.DictReader(stream)
         
         # Check required columns
-        if 'email' not in csv_input.fieldnames:
+        if not csv_input.fieldnames or 'email' not in csv_input.fieldnames:
             return jsonify({"error": "CSV must contain an 'email' column"}), 400
+
+        parallel = (request.content_length or 0) >= PARALLEL_VALIDATION_BYTES
+        progress = import_leads_stream(csv_input, list_name, batch_size, dedupe, parallel, delta=(mode == 'delta'))
+
+        # Stream one NDJSON progress line per batch when requested
+        if request.args.get('stream') == '1':
+            def generate():
+                try:
+                    for record in progress:
+                        if "batch" in record:
+                            app.logger.info("Lead import %s: batch %d", list_name, record["batch"])
+                        yield json.dumps(record) + "\n"
+                except Exception as e:
+                    # Headers are already sent; end with an error record so the client
+                    # can tell a failed import from a finished one
+                    app.logger.error("Error in api_import_leads stream: %s", traceback.format_exc())
+                    yield json.dumps({"error": "internal_server_error", "detail": str(e)}) + "\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        summary = {}
+        sample = None
+        for record in progress:
+            if "error" in record:
+                return jsonify({"error": record["error"], "detail": record["detail"]}), 500
+            if "batch" in record:
+                app.logger.info("Lead import %s: batch %d, %d imported", list_name, record["batch"], record["imported"])
+                if sample is None:
+                    sample = record["sample"]
+                summary["batches"] = record["batch"]
+            else:
+                summary.update(record)
         
-        # Process rows and remove duplicates
-        leads_dict = {}  # Use dictionary to track unique emails
-        for row in csv_input:
-            if not row.get('email'):
-                continue
-                
-            # Clean the row data
-            cleaned_row = {}
-            for key, value in row.items():
-                if value is not None:
-                    cleaned_row[key.strip().lower()] = value.strip()
-            
-            email = cleaned_row.get('email', '').lower()
-            
-            # Skip if email is invalid
-            try:
-                validate_email(email)
-            except EmailNotValidError:
-                continue
-            
-            lead_data = {
-                "email": email,
-                "name": cleaned_row.get('name', ''),
-                "last_name": cleaned_row.get('last_name', cleaned_row.get('last name', '')),
-                "city": cleaned_row.get('city', ''),
-                "brokerage": cleaned_row.get('brokerage', ''),
-                "service": cleaned_row.get('service', ''),
-                "list_name": list_name,
-                "custom_fields": {k: v for k, v in cleaned_row.items() if k not in ['email', 'name', 'last_name', 'last name', 'city', 'brokerage', 'service', 'list_name']}
-            }
-            
-            # Keep only the last occurrence of each email
-            leads_dict[email] = lead_data
-        
-        leads = list(leads_dict.values())
-        
-        # Store in database
-        if leads:
-            # Insert in chunks to avoid payload size issues
-            CHUNK_SIZE = 100
-            imported_count = 0
-            for i in range(0, len(leads), CHUNK_SIZE):
-                chunk = leads[i:i+CHUNK_SIZE]
-                result = supabase.table("leads").upsert(chunk, on_conflict="email").execute()
-                if getattr(result, "error", None):
-                    return jsonify({"error": "db_error", "detail": str(result.error)}), 500
-                imported_count += len(chunk)
-        
-        return jsonify({
+        response = {
             "ok": True, 
-            "imported": len(leads),
-            "sample": leads[0] if leads else {}
-        }), 200
+            "mode": mode,
+            "imported": summary.get("imported", 0),
+            "duplicates": summary.get("duplicates", 0),
+            "batches": summary.get("batches", 0),
+            "rejected_count": summary.get("rejected_count", 0),
+            "rejected": summary.get("rejected", []),
+            "sample": sample or {}
+        }
+        if mode == 'delta':
+            for key in ("inserted", "updated", "unchanged"):
+                response[key] = summary.get(key, 0)
+        return jsonify(response), 200
         
     except Exception as e:
         app.logger.error("Error in api_import_leads: %s", traceback.format_exc())
@@ -383,19 +708,151 @@ def api_get_leads_by_list(list_name):
     except Exception as e:
         return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
 
-@app.route('/api/smtp-accounts', methods=['POST'])
-def api_add_smtp_account():
+# ---------- Streaming exports ----------
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", 1000))
+
+def iter_table_rows(table, columns="*", filters=None, page_size=EXPORT_PAGE_SIZE):
+    """Yield rows in id order, reading one keyset-paginated page at a time"""
+    last_id = None
+    while True:
+        query = supabase.table(table).select(columns)
+        for column, value in (filters or {}).items():
+            query = query.eq(column, value)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.order("id").limit(page_size).execute()
+
+        yield from page.data
+        if len(page.data) < page_size:
+            return
+        last_id = page.data[-1]["id"]
+
+def iter_csv(rows):
+    """Encode rows as CSV lines, using the first row's keys as the header"""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow({k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in row.items()})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+def export_response(rows, filename):
+    """Stream rows as CSV or NDJSON (?format=) without building the export in memory"""
+    export_format = request.args.get('format', 'csv')
+    if export_format == 'ndjson':
+        body, mimetype, extension = iter_ndjson(rows), "application/x-ndjson", "ndjson"
+    elif export_format == 'csv':
+        body, mimetype, extension = iter_csv(rows), "text/csv", "csv"
+    else:
+        return jsonify({"error": "format must be 'csv' or 'ndjson'"}), 400
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers=attachment_headers(f"{filename}.{extension}")
+    )
+
+@app.route('/api/export/leads', methods=['GET'])
+def api_export_leads():
+    list_name = request.args.get('list_name')
+    filters = {"list_name": list_name} if list_name else None
+    return export_response(iter_table_rows("leads", filters=filters), f"leads_{list_name or 'all'}")
+
+@app.route('/api/export/responded-leads', methods=['GET'])
+def api_export_responded_leads():
+    return export_response(iter_table_rows("responded_leads"), "responded_leads")
+
+@app.route('/api/export/campaigns/<int:campaign_id>/clicks', methods=['GET'])
+def api_export_campaign_clicks(campaign_id):
+    rows = iter_table_rows("link_clicks", filters={"campaign_id": campaign_id})
+    return export_response(rows, f"campaign_{campaign_id}_clicks")
+
+@app.route('/api/export/campaigns/<int:campaign_id>/queue', methods=['GET'])
+def api_export_campaign_queue(campaign_id):
+    rows = iter_table_rows(
+        "email_queue",
+        columns="id, lead_id, lead_email, sequence, scheduled_for, sent_at, sent_from",
+        filters={"campaign_id": campaign_id}
+    )
+    return export_response(rows, f"campaign_{campaign_id}_queue")
+
+# ---------- Account verification ----------
+VERIFY_CONNECT_TIMEOUT = float(os.environ.get("VERIFY_CONNECT_TIMEOUT", 10))
+VERIFY_READ_TIMEOUT = float(os.environ.get("VERIFY_READ_TIMEOUT", 15))
+VERIFY_WORKERS = int(os.environ.get("VERIFY_WORKERS", 4))
+# Verification jobs and the handshakes they wait on use separate pools so jobs can't starve their own checks
+verification_executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS)
+handshake_executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS * 2)
+
+def check_smtp_login(host, port, username, password):
+    """Connect, STARTTLS and log in; return the handshake time in ms"""
+    started = time.monotonic()
+    smtp = smtplib.SMTP(host, port, timeout=VERIFY_CONNECT_TIMEOUT)
     try:
-        data = request.get_json(force=True)
-        
-        # Test SMTP connection first
+        smtp.sock.settimeout(VERIFY_READ_TIMEOUT)
+        smtp.starttls()  # Use TLS for security
+        smtp.login(username, password)
+    finally:
         try:
-            smtp = smtplib.SMTP(data['smtp_host'], data['smtp_port'])
-            smtp.starttls()  # Use TLS for security
-            smtp.login(data['smtp_username'], data['smtp_password'])
             smtp.quit()
+        except Exception:
+            smtp.close()
+    return int((time.monotonic() - started) * 1000)
+
+def check_imap_login(host, port, username, password):
+    """Connect over SSL and log in; return the handshake time in ms"""
+    started = time.monotonic()
+    mail = imaplib.IMAP4_SSL(host, port or imaplib.IMAP4_SSL_PORT, timeout=VERIFY_CONNECT_TIMEOUT)
+    try:
+        mail.sock.settimeout(VERIFY_READ_TIMEOUT)
+        mail.login(username, password)
+    finally:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+    return int((time.monotonic() - started) * 1000)
+
+def verify_smtp_account(account):
+    """Run the SMTP and IMAP checks for a stored account in parallel and record the outcome"""
+    password = aesgcm_decrypt(account['encrypted_smtp_password'])
+    checks = {
+        "smtp": handshake_executor.submit(
+            check_smtp_login, account['smtp_host'], account['smtp_port'], account['smtp_username'], password)
+    }
+    if account.get('imap_host'):
+        checks["imap"] = handshake_executor.submit(
+            check_imap_login, account['imap_host'], account.get('imap_port'), account['smtp_username'], password)
+
+    update = {"verification_status": "verified", "verification_error": None, "verified_at": datetime.now(timezone.utc).isoformat()}
+    errors = []
+    for name, future in checks.items():
+        try:
+            update[f"{name}_latency_ms"] = future.result()
         except Exception as e:
-            return jsonify({"error": "smtp_connection_failed", "detail": str(e)}), 400
+            errors.append(f"{name}: {str(e)}")
+    if errors:
+        update["verification_status"] = "failed"
+        update["verification_error"] = "; ".join(errors)
+
+    try:
+        supabase.table("smtp_accounts").update(update).eq("id", account['id']).execute()
+        invalidate_cache("smtp_accounts", "account_status")
+    except Exception as e:
+        print(f"Error saving verification for account {account['id']}: {str(e)}")
+
+@app.route('/api/smtp-accounts', methods=['POST'])
+def api_add_smtp_account():
+    try:
+        data = request.get_json(force=True)
         
         # Encrypt password before storing
         encrypted_password = aesgcm_encrypt(data['smtp_password'])
@@ -409,18 +866,44 @@ def api_add_smtp_account():
             "smtp_username": data['smtp_username'],
             "encrypted_smtp_password": encrypted_password,
             "imap_host": data.get('imap_host'),
-            "imap_port": data.get('imap_port')
+            "imap_port": data.get('imap_port'),
+            "verification_status": "pending_verification"
         }
         
         result = supabase.table("smtp_accounts").insert(account_data).execute()
         if getattr(result, "error", None):
             return jsonify({"error": "db_error", "detail": str(result.error)}), 500
+        invalidate_cache("smtp_accounts", "account_status")
+
+        # Verify the credentials in the background instead of holding the request open
+        account = result.data[0]
+        verification_executor.submit(verify_smtp_account, account)
         
-        return jsonify({"ok": True, "account": result.data[0]}), 200
+        return jsonify({"ok": True, "account": account}), 202
         
     except Exception as e:
         return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
 
+# Re-run verification, e.g. after a failure or when a restart lost the background check
+@app.route('/api/smtp-accounts/<int:account_id>/verify', methods=['POST'])
+def api_verify_smtp_account(account_id):
+    try:
+        result = supabase.table("smtp_accounts").select("*").eq("id", account_id).execute()
+        if not result.data:
+            return jsonify({"error": "not_found", "detail": f"No SMTP account {account_id}"}), 404
+        account = result.data[0]
+
+        supabase.table("smtp_accounts").update({
+            "verification_status": "pending_verification",
+            "verification_error": None
+        }).eq("id", account_id).execute()
+        invalidate_cache("smtp_accounts", "account_status")
+
+        verification_executor.submit(verify_smtp_account, account)
+        return jsonify({"ok": True, "account_id": account_id, "verification_status": "pending_verification"}), 202
+    except Exception as e:
+        return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
+
 # Add this to app.py
 @app.route('/api/lead-campaign-accounts', methods=['GET'])
 def api_get_lead_campaign_accounts():
@@ -438,7 +921,35 @@ def api_get_responded_leads():
     except Exception as e:
         return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
 
-# Update the route to use integer IDs
+@app.route('/t/<token>')
+def track_token_click(token):
+    decoded = verify_token(token)
+    if decoded is None:
+        return "Invalid tracking link", 404
+    email_queue_id, link_index = decoded
+
+    try:
+        link = get_tracked_links(email_queue_id).get(link_index)
+    except LookupError:
+        link = None
+    except Exception as e:
+        print(f"Error tracking click: {str(e)}")
+        return "Error tracking click", 500
+    if link is None:
+        return "Invalid tracking link", 404
+
+    # Queue the click; it is bulk inserted in the background
+    click_buffer.add({
+        "lead_id": link["lead_id"],
+        "campaign_id": link["campaign_id"],
+        "url": link["url"],
+        "email_queue_id": email_queue_id,
+        "clicked_at": datetime.now(timezone.utc).isoformat()
+    })
+
+    return redirect(demo_redirect_url(link["lead_id"], link["campaign_id"], email_queue_id))
+
+# Legacy links sent before signed tokens; kept so old emails still resolve
 @app.route('/track/<lead_id>/<campaign_id>')
 def track_click(lead_id, campaign_id):
     try:
@@ -452,61 +963,85 @@ def track_click(lead_id, campaign_id):
         
         # Get the email_queue_id if available
         email_queue_id = request.args.get('eqid', None)
-        
-        # Convert IDs to integers if possible
-        try:
-            lead_id_int = int(lead_id)
-        except (ValueError, TypeError):
-            lead_id_int = None
-            
+
         try:
-            campaign_id_int = int(campaign_id)
-        except (ValueError, TypeError):
-            campaign_id_int = None
-        
-        # Record the click in the database
-        supabase.table("link_clicks").insert({
+            lead_id_int, campaign_id_int, email_queue_id = click_ids(lead_id, campaign_id, email_queue_id)
+        except ValueError as e:
+            return str(e), 400
+
+        # Queue the click; it is bulk inserted in the background
+        click_buffer.add({
             "lead_id": lead_id_int,
             "campaign_id": campaign_id_int,
             "url": original_url,
-            "email_queue_id": email_queue_id
-        }).execute()
+            "email_queue_id": email_queue_id,
+            "clicked_at": datetime.now(timezone.utc).isoformat()
+        })
         
         # Redirect to the demo page with lead_id as parameter
-        demo_url = "https://xxxloveitxxx.github.io/tha-clone-of-admin/templates/demo6.html"
-        redirect_url = f"{demo_url}?lead_id={lead_id}&campaign_id={campaign_id}"
-        if email_queue_id:
-            redirect_url += f"&eqid={email_queue_id}"
-            
-        return redirect(redirect_url)
+        return redirect(demo_redirect_url(lead_id, campaign_id, email_queue_id))
         
     except Exception as e:
         print(f"Error tracking click: {str(e)}")
         return "Error tracking click", 500
 
+CLICK_PAGE_SIZE = 100
+CLICK_PAGE_MAX = 1000
+
+def paginate_clicks(query):
+    """Apply ?limit= and ?before=<id> keyset pagination to a link_clicks query"""
+    limit = max(1, min(request.args.get('limit', CLICK_PAGE_SIZE, type=int), CLICK_PAGE_MAX))
+    before = request.args.get('before', type=int)
+    if before is not None:
+        query = query.lt("id", before)
+    clicks = query.order("id", desc=True).limit(limit).execute()
+    next_before = clicks.data[-1]["id"] if len(clicks.data) == limit else None
+    return clicks.data, next_before
+
 @app.route('/api/campaigns/<int:campaign_id>/clicks')
 def api_get_campaign_clicks(campaign_id):
     try:
-        clicks = supabase.table("link_clicks") \
-            .select("*, leads(email, name)") \
+        clicks, next_before = paginate_clicks(
+            supabase.table("link_clicks")
+            .select("*, leads(email, name)")
+            .eq("campaign_id", campaign_id)
+        )
+        return jsonify({"ok": True, "clicks": clicks, "next_before": next_before}), 200
+    except Exception as e:
+        return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
+
+@app.route('/api/campaigns/<int:campaign_id>/clicks/summary')
+def api_get_campaign_click_summary(campaign_id):
+    try:
+        rollups = supabase.table("click_rollups") \
+            .select("bucket, bucket_key, clicks") \
             .eq("campaign_id", campaign_id) \
-            .order("clicked_at", desc=True) \
             .execute()
-        
-        return jsonify({"ok": True, "clicks": clicks.data}), 200
+
+        summary = {"clicks": 0, "unique_clickers": 0, "by_url": {}, "by_hour": {}}
+        for row in rollups.data:
+            if row["bucket"] == "total":
+                summary["clicks"] = row["clicks"]
+            elif row["bucket"] == "unique":
+                summary["unique_clickers"] = row["clicks"]
+            elif row["bucket"] == "url":
+                summary["by_url"][row["bucket_key"]] = row["clicks"]
+            elif row["bucket"] == "hour":
+                summary["by_hour"][row["bucket_key"]] = row["clicks"]
+
+        return jsonify({"ok": True, "campaign_id": campaign_id, "summary": summary}), 200
     except Exception as e:
         return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
 
 @app.route('/api/leads/<int:lead_id>/clicks')
 def api_get_lead_clicks(lead_id):
     try:
-        clicks = supabase.table("link_clicks") \
-            .select("*, campaigns(name)") \
-            .eq("lead_id", lead_id) \
-            .order("clicked_at", desc=True) \
-            .execute()
-        
-        return jsonify({"ok": True, "clicks": clicks.data}), 200
+        clicks, next_before = paginate_clicks(
+            supabase.table("link_clicks")
+            .select("*, campaigns(name)")
+            .eq("lead_id", lead_id)
+        )
+        return jsonify({"ok": True, "clicks": clicks, "next_before": next_before}), 200
     except Exception as e:
         return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
 
@@ -529,21 +1064,29 @@ def api_track_click():
         
         if not all([lead_id, campaign_id, url]):
             return "Missing parameters", 400
-            
-        # Record the click in the database
-        supabase.table("link_clicks").insert({
+
+        try:
+            lead_id, campaign_id, email_queue_id = click_ids(lead_id, campaign_id, email_queue_id)
+        except ValueError as e:
+            if request.method == 'POST':
+                return jsonify({"error": "invalid_parameters", "detail": str(e)}), 400
+            return str(e), 400
+
+        # Queue the click; it is bulk inserted in the background
+        click_buffer.add({
             "lead_id": lead_id,
             "campaign_id": campaign_id,
             "url": url,
-            "email_queue_id": email_queue_id
-        }).execute()
+            "email_queue_id": email_queue_id,
+            "clicked_at": datetime.now(timezone.utc).isoformat()
+        })
         
         # For POST requests, return JSON response instead of redirecting
         if request.method == 'POST':
             return jsonify({"ok": True}), 200
         else:
-            # For GET requests, redirect to the original URL
-            return redirect(url)
+            # For GET requests, redirect to the original URL if this email really links to it
+            return redirect(tracked_redirect_url(url, lead_id, campaign_id, email_queue_id))
         
     except Exception as e:
         print(f"Error tracking click: {str(e)}")
@@ -572,7 +1115,11 @@ def demo():
                          supabase_anon_key=os.environ['SUPABASE_ANON_KEY'])
 
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.route('/api/generate-reply-prompt', methods=['OPTIONS', 'POST'])
+@ai_bulkhead.limit
 def generate_reply_prompt():
     if request.method == "OPTIONS":
         # Handle preflight request
@@ -586,107 +1133,63 @@ def generate_reply_prompt():
     if not prompt:
         return jsonify({"error": "Missing prompt"}), 400
 
-    # Enhanced prompt to generate reply and three follow-ups
-    enhanced_prompt = f"""
-    Generate a professional real estate agent reply to the following email, and then generate three follow-up emails that would be sent later.
-    Format your response exactly as follows:
+    try:
+        return jsonify(generate_reply(prompt, timeout=30))
+    except RuntimeError:
+        return jsonify({"error": "All models failed or were rate-limited"}), 500
+    except Exception as e:
+        print(f"Error generating reply: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
-    === REPLY ===
-    [Your main reply here]
+@app.route('/api/generate-reply-prompt/stream', methods=['GET', 'POST'])
+def generate_reply_prompt_stream():
+    # EventSource can only GET, so the prompt may come from the query string
+    if request.method == 'POST':
+        prompt = request.get_json(force=True).get("prompt", "").strip()
+    else:
+        prompt = request.args.get("prompt", "").strip()
+    if not prompt:
+        return jsonify({"error": "Missing prompt"}), 400
 
-    === FOLLOW UP 1 ===
-    [First follow-up email]
+    # The slot is held until the stream closes, not just until the view returns
+    try:
+        ai_bulkhead.enter()
+    except BulkheadFull:
+        return overloaded_response()
 
-    === FOLLOW UP 2 ===
-    [Second follow-up email]
+    def events():
+        # Push each section as soon as the model moves past it
+        try:
+            for section, content in stream_reply_sections(prompt, timeout=30):
+                yield sse_event("section", {"section": section, "content": content})
+            yield sse_event("done", {})
+        except Exception as e:
+            print(f"Error streaming reply: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
 
-    === FOLLOW UP 3 ===
-    [Third follow-up email]
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(ai_bulkhead.leave)
+    return response
 
-    Email to respond to:
-    {prompt}
-    """
+@app.route('/api/ai-status', methods=['GET'])
+def api_get_ai_status():
+    return jsonify({
+        "ok": True,
+        "http": http_client.metrics(),
+        "models": model_router.stats(),
+        "bulkhead": ai_bulkhead.stats()
+    }), 200
 
-    try:
-        # Use the GitHub AI models
-        GITHUB_TOKEN = os.environ["GITHUB_TOKEN"]
-        MODELS = os.environ.get("GH_MODELS", "openai/gpt-4o-mini").split(",")
-        
-        full_response = ""
-        for model in MODELS:
-            try:
-                resp = requests.post(
-                    "https://models.github.ai/inference/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {GITHUB_TOKEN}",
-                        "Accept": "application/vnd.github+json",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": model.strip(),
-                        "messages": [
-                            {"role": "system", "content": "You are a professional real estate agent."},
-                            {"role": "user",   "content": enhanced_prompt}
-                        ],
-                        "temperature": 0.7,
-                        "top_p": 0.7,
-                        "max_tokens": 512
-                    },
-                    timeout=30
-                )
-                
-                if resp.status_code == 200:
-                    full_response = resp.json()["choices"][0]["message"]["content"].strip()
-                    break
-                elif resp.status_code in (404, 429):
-                    continue
-            except Exception as e:
-                print(f"Error with model {model}: {str(e)}")
-                continue
-        
-        if not full_response:
-            return jsonify({"error": "All models failed or were rate-limited"}), 500
-        
-        # Parse the response to extract reply and follow-ups
-        sections = {}
-        current_section = None
-        lines = full_response.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if line == "=== REPLY ===":
-                current_section = 'reply'
-                sections[current_section] = []
-            elif line == "=== FOLLOW UP 1 ===":
-                current_section = 'follow_up_1'
-                sections[current_section] = []
-            elif line == "=== FOLLOW UP 2 ===":
-                current_section = 'follow_up_2'
-                sections[current_section] = []
-            elif line == "=== FOLLOW UP 3 ===":
-                current_section = 'follow_up_3'
-                sections[current_section] = []
-            elif current_section and line:
-                sections[current_section].append(line)
-        
-        # Join the lines for each section
-        reply = ' '.join(sections.get('reply', [])).strip()
-        follow_ups = [
-            ' '.join(sections.get('follow_up_1', [])).strip(),
-            ' '.join(sections.get('follow_up_2', [])).strip(),
-            ' '.join(sections.get('follow_up_3', [])).strip()
-        ]
-        
-        # Remove any empty follow-ups
-        follow_ups = [fu for fu in follow_ups if fu]
-        
-        return jsonify({
-            "reply": reply,
-            "follow_ups": follow_ups
-        })
-    except Exception as e:
-        print(f"Error generating reply: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+def record_ai_usage(usage):
+    """Atomically add [{"lead_id", "count"}] increments to ai_demo_usage (sql/ai_demo_usage.sql)"""
+    return supabase.rpc("record_ai_usage", {"usage": usage}).execute()
+
+AI_USAGE_COALESCE = os.environ.get("AI_USAGE_COALESCE", "").lower() in ("1", "true", "yes")
+ai_usage_buffer = UsageBuffer(record_ai_usage)
 
 @app.route('/api/record-ai-usage', methods=['POST'])
 def api_record_ai_usage():
@@ -697,52 +1200,23 @@ def api_record_ai_usage():
         if not lead_id:
             return jsonify({"error": "Lead ID is required"}), 400
         
-        # Convert to integer if needed
+        # Convert to integer; the counter RPC keys on numeric lead ids
         try:
             lead_id = int(lead_id)
         except (ValueError, TypeError):
-            pass
+            return jsonify({"error": "Lead ID must be an integer"}), 400
         
-        # Get the lead's email
-        lead = supabase.table("leads") \
-            .select("email") \
-            .eq("id", lead_id) \
-            .single() \
-            .execute()
+        # Under burst load, coalesce increments in memory and flush them periodically
+        if AI_USAGE_COALESCE:
+            ai_usage_buffer.add(lead_id)
+            return jsonify({"ok": True, "queued": True}), 202
         
-        if not lead.data:
+        # Look up the lead's email and upsert-increment its usage in one round trip
+        result = record_ai_usage([{"lead_id": lead_id, "count": 1}])
+        if not result.data:
             return jsonify({"error": "Lead not found"}), 404
         
-        email = lead.data['email']
-        
-        # Check if we already have a record for this email
-        existing = supabase.table("ai_demo_usage") \
-            .select("*") \
-            .eq("email", email) \
-            .execute()
-        
-        if existing.data:
-            # Update existing record
-            supabase.table("ai_demo_usage") \
-                .update({
-                    "usage_count": existing.data[0]['usage_count'] + 1,
-                    "last_used_at": datetime.now(timezone.utc).isoformat()
-                }) \
-                .eq("email", email) \
-                .execute()
-        else:
-            # Create new record
-            supabase.table("ai_demo_usage") \
-                .insert({
-                    "lead_id": lead_id,
-                    "email": email,
-                    "usage_count": 1,
-                    "first_used_at": datetime.now(timezone.utc).isoformat(),
-                    "last_used_at": datetime.now(timezone.utc).isoformat()
-                }) \
-                .execute()
-        
-        return jsonify({"ok": True}), 200
+        return jsonify({"ok": True, "usage_count": result.data[0]['usage_count']}), 200
         
     except Exception as e:
         print(f"Error recording AI usage: {str(e)}")
@@ -0,0 +1,72 @@
+# benchmarks/reply_latency.py
+"""Compare proxied vs in-process reply generation latency.
+
+Runs demoapp.py on a local port with the deterministic stub backend and times
+the same prompts through an HTTP hop (the old proxy path) and through a direct
+reply_service.generate_reply() call. Pass --upstream URL to time a real
+deployment instead of the local server for the proxied side.
+
+    python benchmarks/reply_latency.py -n 200
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import statistics
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("REPLY_BACKEND", "stub")
+
+from werkzeug.serving import make_server
+import http_client
+import demoapp
+from reply_service import generate_reply
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(f"{name:<12} n={len(samples):<5} p50={p50 * 1000:8.2f} ms  p95={p95 * 1000:8.2f} ms")
+
+def time_calls(fn, prompts):
+    samples = []
+    for prompt in prompts:
+        started = time.perf_counter()
+        fn(prompt)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=100, help="requests per path")
+    parser.add_argument("--upstream", help="generate-reply-prompt URL to use for the proxied path")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = None
+    upstream = args.upstream
+    if not upstream:
+        server = make_server("127.0.0.1", 0, demoapp.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        upstream = f"http://127.0.0.1:{server.server_port}/api/generate-reply-prompt"
+
+    prompts = [f"Hi, is the house on Main St #{i} still available?" for i in range(args.n)]
+
+    def proxied(prompt):
+        resp = http_client.post(upstream, json={"prompt": prompt}, read_timeout=60)
+        resp.raise_for_status()
+        return resp.json()
+
+    def in_process(prompt):
+        return generate_reply(prompt)
+
+    summarize("proxied", time_calls(proxied, prompts))
+    summarize("in-process", time_calls(in_process, prompts))
+
+    if server:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
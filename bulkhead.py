@@ -0,0 +1,101 @@
+# bulkhead.py
+import os
+import functools
+import threading
+from flask import jsonify, request
+
+AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", 4))
+AI_MAX_QUEUE = int(os.environ.get("AI_MAX_QUEUE", 4))
+AI_QUEUE_TIMEOUT = float(os.environ.get("AI_QUEUE_TIMEOUT", 2))
+
+
+class BulkheadFull(Exception):
+    pass
+
+
+class Bulkhead:
+    """Caps how many slow calls run at once so they can't take every worker thread.
+
+    Up to max_concurrent callers run; up to max_queue more wait at most queue_timeout
+    seconds for a slot. Anyone beyond that is rejected straight away.
+    """
+
+    def __init__(self, name, max_concurrent=AI_MAX_CONCURRENCY, max_queue=AI_MAX_QUEUE,
+                 queue_timeout=AI_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+
+    def enter(self):
+        """Take a slot or raise BulkheadFull; pair every successful call with leave()"""
+        if self.slots.acquire(blocking=False):
+            self._entered()
+            return
+
+        with self.lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise BulkheadFull(self.name)
+            self.waiting += 1
+        try:
+            acquired = self.slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not acquired:
+            with self.lock:
+                self.rejected += 1
+            raise BulkheadFull(self.name)
+        self._entered()
+
+    def _entered(self):
+        with self.lock:
+            self.active += 1
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+        self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active": self.active,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+            }
+
+    def limit(self, view):
+        """Route decorator that sheds load with a 503 when the bulkhead is full"""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method == "OPTIONS":
+                return view(*args, **kwargs)
+            try:
+                self.enter()
+            except BulkheadFull:
+                return overloaded_response()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                self.leave()
+        return wrapper
+
+
+def overloaded_response():
+    response = jsonify({"error": "ai_overloaded", "detail": "Too many AI requests in progress, try again shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+# Shared by every AI route in the process
+ai_bulkhead = Bulkhead("ai")
@@ -1,10 +1,12 @@
 # check_replies.py
 import os
+import time
 import imaplib
 import email
 import base64
 from email.header import decode_header
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
 from supabase import create_client
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
@@ -14,6 +16,18 @@ SUPABASE_URL = os.environ['SUPABASE_URL']
 SUPABASE_KEY = os.environ['SUPABASE_SERVICE_ROLE_KEY']
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Mailboxes polled at once, and per-account limits so one slow server can't stall the run
+IMAP_POLL_CONCURRENCY = int(os.environ.get("IMAP_POLL_CONCURRENCY", 8))
+IMAP_SOCKET_TIMEOUT = float(os.environ.get("IMAP_SOCKET_TIMEOUT", 30))
+IMAP_ACCOUNT_TIMEOUT = float(os.environ.get("IMAP_ACCOUNT_TIMEOUT", 180))
+# How far back to look in a mailbox that has no checkpoint yet (or whose UIDVALIDITY changed)
+IMAP_INITIAL_LOOKBACK_DAYS = int(os.environ.get("IMAP_INITIAL_LOOKBACK_DAYS", 2))
+# UIDs per UID FETCH command, keeping command lines within server limits
+IMAP_FETCH_BATCH = 500
+REPLY_HEADERS = "(UID BODY.PEEK[HEADER.FIELDS (FROM SUBJECT IN-REPLY-TO REFERENCES AUTO-SUBMITTED)])"
+# Sender addresses per leads lookup, keeping the in_ filter's URL short
+LEAD_LOOKUP_CHUNK = 200
+
 # Encryption functions
 ENCRYPTION_KEY = bytes.fromhex(os.environ['ENCRYPTION_KEY'])
 
@@ -25,85 +39,167 @@ def aesgcm_decrypt(b64text: str) -> str:
     pt = aesgcm.decrypt(nonce, ct, None)
     return pt.decode('utf-8')
 
+def resolve_leads(addresses):
+    """{lead id: email} for the leads matching any of the sender addresses"""
+    addresses = sorted(addresses)
+    leads = {}
+    for i in range(0, len(addresses), LEAD_LOOKUP_CHUNK):
+        result = supabase.table("leads").select("id, email") \
+            .in_("email", addresses[i:i + LEAD_LOOKUP_CHUNK]) \
+            .execute()
+        leads.update((lead['id'], lead['email']) for lead in result.data)
+    return leads
+
+def mark_leads_responded(addresses):
+    """Mark every lead that replied as responded in one transactional RPC.
+
+    The RPC copies each lead to responded_leads, clears its queued emails and account
+    assignments and flags it responded; leads already marked are skipped, so a lead
+    replying several times is only recorded once. Returns the newly marked leads.
+    """
+    leads = resolve_leads(addresses)
+    if not leads:
+        return []
+    result = supabase.rpc("mark_leads_responded", {"lead_ids": sorted(leads)}).execute()
+    for lead in result.data or []:
+        print(f"Marked lead {lead['email']} as responded")
+    return result.data or []
+
+def sender_address(from_header):
+    """Bare email address from a From header"""
+    # Extract email address from the From field
+    email_match = re.search(r'<(.+?)>', from_header)
+    if email_match:
+        return email_match.group(1)
+    # If no angle brackets, try to extract email directly
+    email_match = re.search(r'[\w\.-]+@[\w\.-]+', from_header)
+    if email_match:
+        return email_match.group(0)
+    return from_header
+
+def is_reply(msg):
+    """A reply threads onto an earlier message or at least has a "Re:" subject.
+
+    Auto-replies and bounces (Auto-Submitted other than "no", RFC 3834) don't count.
+    """
+    auto_submitted = (msg.get("Auto-Submitted") or "").strip().lower()
+    if auto_submitted and auto_submitted != "no":
+        return False
+    if msg.get("In-Reply-To") or msg.get("References"):
+        return True
+    subject = decode_header(msg.get("Subject") or "")[0][0]
+    if isinstance(subject, bytes):
+        subject = subject.decode(errors="replace")
+    return subject.strip().lower().startswith("re:")
+
+def new_uids(mail, account):
+    """(uidvalidity, UIDs after the account's checkpoint, new last UID) for the selected mailbox"""
+    uidvalidity = int(mail.response('UIDVALIDITY')[1][0])
+    uidnext = mail.response('UIDNEXT')[1][0]
+    last_uid = account.get('imap_last_uid') or 0
+    if account.get('imap_uidvalidity') == uidvalidity and last_uid:
+        status, data = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+    else:
+        # No usable checkpoint: UIDs were renumbered or this is the first sync
+        last_uid = 0
+        since_date = (datetime.now() - timedelta(days=IMAP_INITIAL_LOOKBACK_DAYS)).strftime("%d-%b-%Y")
+        status, data = mail.uid('SEARCH', None, f'SINCE {since_date}')
+    # "n:*" always matches the newest message, even when it is older than n
+    uids = sorted(int(uid) for uid in data[0].split() if int(uid) > last_uid)
+    if uids:
+        last_uid = uids[-1]
+    elif uidnext:
+        last_uid = max(last_uid, int(uidnext) - 1)
+    return uidvalidity, uids, last_uid
+
+def fetch_headers(mail, uids):
+    """Yield the headers of each of uids with batched header-only UID FETCHes; bodies are never downloaded.
+
+    Every literal in the response is a message's headers. The UID isn't needed, and
+    servers may send it after the literal, where imaplib doesn't put it in the tuple.
+    """
+    for i in range(0, len(uids), IMAP_FETCH_BATCH):
+        batch = ",".join(str(uid) for uid in uids[i:i + IMAP_FETCH_BATCH])
+        status, msg_data = mail.uid('FETCH', batch, REPLY_HEADERS)
+        for response in msg_data:
+            if isinstance(response, tuple):
+                yield email.message_from_bytes(response[1])
+
+def poll_account(account):
+    """Collect reply senders in one mailbox since its checkpoint.
+
+    Returns (sender addresses, checkpoint update or None). Nothing is written here:
+    the checkpoint is saved by check_for_replies once the replies are recorded.
+    Only new UIDs are examined, using the From/Subject/In-Reply-To/References/
+    Auto-Submitted headers.
+    Every IMAP call is bounded by IMAP_SOCKET_TIMEOUT and the whole mailbox by
+    IMAP_ACCOUNT_TIMEOUT, checked between messages.
+    """
+    deadline = time.monotonic() + IMAP_ACCOUNT_TIMEOUT
+    senders = set()
+
+    # Connect to IMAP server
+    mail = imaplib.IMAP4_SSL(account['imap_host'], account['imap_port'], timeout=IMAP_SOCKET_TIMEOUT)
+    try:
+        mail.login(account['smtp_username'], aesgcm_decrypt(account['encrypted_smtp_password']))
+        mail.select('inbox', readonly=True)
+
+        uidvalidity, uids, last_uid = new_uids(mail, account)
+        for msg in fetch_headers(mail, uids):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"gave up after {IMAP_ACCOUNT_TIMEOUT:.0f}s with {len(uids)} messages to check")
+            if is_reply(msg):
+                senders.add(sender_address(msg.get("From") or "").strip().lower())
+
+        mail.close()
+    finally:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+    checkpoint = None
+    if (uidvalidity, last_uid) != (account.get('imap_uidvalidity'), account.get('imap_last_uid')):
+        checkpoint = {"imap_uidvalidity": uidvalidity, "imap_last_uid": last_uid}
+    return senders, checkpoint
+
 def check_for_replies():
+    """Poll every IMAP-enabled account concurrently, IMAP_POLL_CONCURRENCY at a time,
+    then record all replies from the pass in one batch"""
     # Get all SMTP accounts with IMAP configured
     accounts = supabase.table("smtp_accounts").select("*").not_.is_("imap_host", "null").execute()
-    
-    for account in accounts.data:
+    if not accounts.data:
+        return
+
+    started = time.monotonic()
+    senders = set()
+    checkpoints = {}
+    failed = 0
+    with ThreadPoolExecutor(max_workers=min(IMAP_POLL_CONCURRENCY, len(accounts.data))) as executor:
+        futures = {executor.submit(poll_account, account): account for account in accounts.data}
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                account_senders, checkpoint = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Error checking replies for {account['email']}: {str(e)}")
+                continue
+            senders |= account_senders
+            if checkpoint:
+                checkpoints[account['id']] = checkpoint
+
+    marked = mark_leads_responded(senders) if senders else []
+
+    # Only move checkpoints forward once the replies they cover are recorded
+    for account_id, checkpoint in checkpoints.items():
         try:
-            # Connect to IMAP server
-            mail = imaplib.IMAP4_SSL(account['imap_host'], account['imap_port'])
-            mail.login(account['smtp_username'], aesgcm_decrypt(account['encrypted_smtp_password']))
-            mail.select('inbox')
-            
-            # Search for unseen emails from the last 24 hours
-            since_date = (datetime.now() - timedelta(days=1)).strftime("%d-%b-%Y")
-            status, messages = mail.search(None, f'(UNSEEN SINCE {since_date})')
-            email_ids = messages[0].split()
-            
-            for email_id in email_ids:
-                # Fetch the email
-                status, msg_data = mail.fetch(email_id, '(RFC822)')
-                
-                for response in msg_data:
-                    if isinstance(response, tuple):
-                        msg = email.message_from_bytes(response[1])
-                        
-                        # Check if this is a reply to one of our sent emails
-                        subject = decode_header(msg["Subject"])[0][0]
-                        if isinstance(subject, bytes):
-                            subject = subject.decode()
-                        
-                        # Check if this email is a reply (starts with "Re:")
-                        if subject.lower().startswith("re:"):
-                            from_email = msg.get("From")
-                            
-                            # Extract email address from the From field
-                            email_match = re.search(r'<(.+?)>', from_email)
-                            if email_match:
-                                from_email = email_match.group(1)
-                            else:
-                                # If no angle brackets, try to extract email directly
-                                email_match = re.search(r'[\w\.-]+@[\w\.-]+', from_email)
-                                if email_match:
-                                    from_email = email_match.group(0)
-                            
-                            # Find the lead by email
-                            lead = supabase.table("leads").select("*").eq("email", from_email).execute()
-                            
-                            if lead.data:
-                                # Copy the lead to responded_leads table
-                                supabase.table("responded_leads").insert({
-                                    "original_lead_id": lead.data[0]['id'],
-                                    "email": lead.data[0]['email'],
-                                    "name": lead.data[0]['name'],
-                                    "last_name": lead.data[0].get('last_name'),
-                                    "city": lead.data[0].get('city'),
-                                    "brokerage": lead.data[0].get('brokerage'),
-                                    "service": lead.data[0].get('service'),
-                                    "list_name": lead.data[0].get('list_name'),
-                                    "custom_fields": lead.data[0].get('custom_fields')
-                                }).execute()
-                                
-                                # Delete any queued emails for this lead
-                                supabase.table("email_queue").delete().eq("lead_id", lead.data[0]['id']).execute()
-                                
-                                # Remove any account assignments for this lead
-                                supabase.table("lead_campaign_accounts").delete().eq("lead_id", lead.data[0]['id']).execute()
-                                
-                                # Mark the lead as responded in the leads table (don't delete it)
-                                supabase.table("leads").update({
-                                    "responded": True,
-                                    "responded_at": datetime.now().isoformat()
-                                }).eq("id", lead.data[0]['id']).execute()
-                                
-                                print(f"Marked lead {from_email} as responded")
-            
-            mail.close()
-            mail.logout()
-            
+            supabase.table("smtp_accounts").update(checkpoint).eq("id", account_id).execute()
         except Exception as e:
-            print(f"Error checking replies for {account['email']}: {str(e)}")
+            print(f"Error saving IMAP checkpoint for account {account_id}: {str(e)}")
+
+    print(f"Checked {len(accounts.data)} mailboxes in {time.monotonic() - started:.1f}s: "
+          f"{len(senders)} reply senders, {len(marked)} leads marked responded, {failed} failed")
 
 if __name__ == "__main__":
     check_for_replies()
@@ -0,0 +1,151 @@
+# click_buffer.py
+import os
+import json
+import tempfile
+import threading
+from collections import deque
+from flusher import PeriodicFlusher
+
+CLICK_FLUSH_SIZE = int(os.environ.get("CLICK_FLUSH_SIZE", 200))
+CLICK_FLUSH_INTERVAL = float(os.environ.get("CLICK_FLUSH_INTERVAL", 2.0))
+CLICK_SPILL_PATH = os.environ.get("CLICK_SPILL_PATH", os.path.join(tempfile.gettempdir(), "link_clicks.spill.ndjson"))
+
+
+def is_data_error(e):
+    """True if the database rejected the rows themselves (SQLSTATE class 22/23, e.g. a bad
+    id or a deleted lead) rather than being unreachable; retrying those as-is never helps"""
+    code = getattr(e, "code", None)
+    return isinstance(code, str) and code[:2] in ("22", "23")
+
+
+class ClickBuffer:
+    """Write-behind buffer for link_clicks.
+
+    Clicks are queued in memory and bulk inserted by a background thread once
+    CLICK_FLUSH_SIZE events are waiting or CLICK_FLUSH_INTERVAL seconds pass. If the
+    insert fails the batch is appended to a local NDJSON spill file, which is replayed
+    on the next successful flush. on_flush, if given, is called with every batch once it
+    has been inserted; batches it fails on go to a second spill file (<spill>.on_flush)
+    and are retried the same way, so rollups built by the hook don't drift.
+
+    A batch the database rejects because of bad rows is split until the offending clicks
+    are isolated; those go to a dead-letter file (<spill>.dead) instead of being retried.
+    """
+
+    def __init__(self, client, table="link_clicks", max_size=CLICK_FLUSH_SIZE,
+                 flush_interval=CLICK_FLUSH_INTERVAL, spill_path=CLICK_SPILL_PATH, on_flush=None):
+        self.client = client
+        self.on_flush = on_flush
+        self.table = table
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.hook_spill_path = f"{spill_path}.on_flush"
+        self.dead_letter_path = f"{spill_path}.dead"
+        self.events = deque()
+        self.flush_lock = threading.Lock()
+        self.flusher = PeriodicFlusher(self.flush, flush_interval, "click-buffer")
+
+    def add(self, click):
+        """Queue a click; this never touches the database"""
+        self.events.append(click)
+        self.flusher.start()
+        if len(self.events) >= self.max_size:
+            self.flusher.wake()
+
+    def _drain(self):
+        batch = []
+        while self.events and len(batch) < self.max_size:
+            batch.append(self.events.popleft())
+        return batch
+
+    def flush(self):
+        """Insert everything queued so far; spill to disk if the database is unreachable"""
+        with self.flush_lock:
+            while self.events:
+                failed = self._insert(self._drain())
+                if failed:
+                    self._spill(failed + self._drain_all())
+                    return
+            self._replay_spill()
+
+    def _drain_all(self):
+        batch = []
+        while self.events:
+            batch.append(self.events.popleft())
+        return batch
+
+    def _insert(self, batch):
+        """Insert batch; returns the clicks left to retry once the database is reachable again"""
+        try:
+            self.client.table(self.table).insert(batch).execute()
+        except Exception as e:
+            if not is_data_error(e):
+                print(f"Error flushing {len(batch)} clicks: {str(e)}")
+                return batch
+            if len(batch) == 1:
+                print(f"Dead-lettering click the database rejected: {str(e)}")
+                self._spill(batch, self.dead_letter_path)
+                return []
+            # Bisect to find the bad rows and still insert the rest
+            mid = len(batch) // 2
+            failed = self._insert(batch[:mid])
+            if failed:
+                return failed + batch[mid:]
+            return self._insert(batch[mid:])
+
+        if self.on_flush and not self._run_hook(batch):
+            self._spill(batch, self.hook_spill_path)
+        return []
+
+    def _run_hook(self, batch):
+        try:
+            self.on_flush(batch)
+        except Exception as e:
+            print(f"Error in click flush hook: {str(e)}")
+            return False
+        return True
+
+    def _spill(self, batch, path=None):
+        path = path or self.spill_path
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                for click in batch:
+                    f.write(json.dumps(click) + "\n")
+        except OSError as e:
+            print(f"Lost {len(batch)} clicks, could not write {path}: {str(e)}")
+
+    def _take_spill(self, path):
+        """Claim a spill file and return its clicks (empty if there is none)"""
+        if not os.path.exists(path):
+            return []
+        replay_path = f"{path}.{os.getpid()}.replay"
+        try:
+            os.replace(path, replay_path)
+        except OSError:
+            return []
+
+        with open(replay_path, encoding="utf-8") as f:
+            clicks = [json.loads(line) for line in f if line.strip()]
+        os.remove(replay_path)
+        return clicks
+
+    def _replay_spill(self):
+        clicks = self._take_spill(self.spill_path)
+        for i in range(0, len(clicks), self.max_size):
+            failed = self._insert(clicks[i:i+self.max_size])
+            if failed:
+                self._spill(failed + clicks[i+self.max_size:])
+                return
+        if clicks:
+            print(f"Replayed {len(clicks)} spilled clicks")
+
+        if not self.on_flush:
+            return
+        hook_clicks = self._take_spill(self.hook_spill_path)
+        for i in range(0, len(hook_clicks), self.max_size):
+            if not self._run_hook(hook_clicks[i:i+self.max_size]):
+                self._spill(hook_clicks[i:], self.hook_spill_path)
+                return
+        if hook_clicks:
+            print(f"Replayed flush hook for {len(hook_clicks)} clicks")
@@ -0,0 +1,17 @@
+# downloads.py
+import unicodedata
+from urllib.parse import quote
+from werkzeug.datastructures import Headers
+
+
+def attachment_headers(filename):
+    """Content-Disposition for a download, quoted the way send_file does it"""
+    try:
+        filename.encode("ascii")
+        options = {"filename": filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+        options = {"filename": simple, "filename*": f"UTF-8''{quote(filename, safe='!#$&+^`|~')}"}
+    headers = Headers()
+    headers.set("Content-Disposition", "attachment", **options)
+    return headers
@@ -0,0 +1,44 @@
+# flusher.py
+import os
+import atexit
+import threading
+
+
+class PeriodicFlusher:
+    """Calls flush every interval seconds, or sooner when woken, on a background thread.
+
+    start() launches the thread lazily so each forked gunicorn worker gets its own
+    flusher; flush also runs once more when the interpreter exits.
+    """
+
+    def __init__(self, flush, interval, name):
+        self.flush = flush
+        self.interval = interval
+        self.name = name
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.thread = None
+        self.pid = None
+        atexit.register(flush)
+
+    def start(self):
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def wake(self):
+        """Flush now instead of waiting for the interval"""
+        self.wake_event.set()
+
+    def _run(self):
+        while True:
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in {self.name} flush: {str(e)}")
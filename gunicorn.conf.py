@@ -0,0 +1,9 @@
+# gunicorn.conf.py
+import os
+
+# Threaded workers so the AI bulkhead (AI_MAX_CONCURRENCY running + AI_MAX_QUEUE waiting)
+# only ever ties up part of each worker; the remaining threads keep /track and the
+# admin API responsive while slow model calls are in flight.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 12))
@@ -0,0 +1,51 @@
+# http_client.py
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 300))
+
+# One keep-alive session per process so outbound calls reuse DNS, TCP and TLS setup
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+metrics_lock = threading.Lock()
+host_metrics = {}
+
+def record(host, elapsed_ms, failed):
+    with metrics_lock:
+        stats = host_metrics.setdefault(host, {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["requests"] += 1
+        stats["errors"] += int(failed)
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+def metrics():
+    """Per-host request counts and latencies since the process started"""
+    with metrics_lock:
+        return {
+            host: {**stats, "avg_ms": round(stats["total_ms"] / stats["requests"], 1)}
+            for host, stats in host_metrics.items()
+        }
+
+def request(method, url, read_timeout=None, connect_timeout=HTTP_CONNECT_TIMEOUT, **kwargs):
+    """Send a request on the shared session with separate connect and read timeouts"""
+    timeout = (connect_timeout, read_timeout or HTTP_READ_TIMEOUT)
+    started = time.monotonic()
+    failed = True
+    try:
+        resp = session.request(method, url, timeout=timeout, **kwargs)
+        failed = resp.status_code >= 500
+        return resp
+    finally:
+        record(urlsplit(url).netloc, (time.monotonic() - started) * 1000, failed)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
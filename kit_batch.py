@@ -0,0 +1,159 @@
+# kit_batch.py
+import os
+import re
+import json
+import time
+import uuid
+import zipfile
+import threading
+
+from kit_builder import ZipStream, iter_render_jobs
+from kit_cache import KIT_CACHE_DIR
+
+KIT_BATCH_MAX = int(os.environ.get("KIT_BATCH_MAX", 200))
+# Finished batches kept around for the status endpoint
+KIT_BATCH_HISTORY = int(os.environ.get("KIT_BATCH_HISTORY", 100))
+# Shared by every worker so any of them can answer a status request
+KIT_BATCH_DIR = os.environ.get("KIT_BATCH_DIR", os.path.join(KIT_CACHE_DIR, "batches"))
+
+BATCH_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BatchRegistry:
+    """Progress of batch kit runs, kept as one JSON file per batch in KIT_BATCH_DIR.
+
+    Only the worker streaming a batch writes its file (atomically, on every change), so
+    any worker can serve the status endpoint. The latest KIT_BATCH_HISTORY files are kept.
+    """
+
+    def __init__(self, batch_dir=KIT_BATCH_DIR, history=KIT_BATCH_HISTORY):
+        self.batch_dir = batch_dir
+        self.history = history
+        # Batches this process is streaming
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def _path(self, batch_id):
+        return os.path.join(self.batch_dir, f"{batch_id}.json")
+
+    def _write(self, batch):
+        path = self._path(batch["batch_id"])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(batch, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error saving batch {batch['batch_id']} status: {str(e)}")
+
+    def _prune(self):
+        try:
+            names = [name for name in os.listdir(self.batch_dir) if name.endswith(".json")]
+            paths = sorted((os.path.join(self.batch_dir, name) for name in names), key=os.path.getmtime)
+        except OSError:
+            return
+        for path in paths[:max(0, len(paths) - self.history)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def create(self, transactions, documents):
+        batch_id = uuid.uuid4().hex
+        batch = {
+            "batch_id": batch_id,
+            "status": "running",
+            "transactions": transactions,
+            "documents": documents,
+            "rendered": 0,
+            "failed": 0,
+            "completed_transactions": 0,
+            "started_at": time.time(),
+            "finished_at": None,
+        }
+        os.makedirs(self.batch_dir, exist_ok=True)
+        with self.lock:
+            self.batches[batch_id] = batch
+            self._write(batch)
+        self._prune()
+        return batch_id
+
+    def update(self, batch_id, **counts):
+        """Add to the batch's counters, e.g. update(batch_id, rendered=1)"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch:
+                for name, delta in counts.items():
+                    batch[name] += delta
+                self._write(batch)
+
+    def finish(self, batch_id, status):
+        with self.lock:
+            batch = self.batches.pop(batch_id, None)
+            if batch:
+                batch["status"] = status
+                batch["finished_at"] = time.time()
+                self._write(batch)
+
+    def get(self, batch_id):
+        if not BATCH_ID_RE.match(batch_id):
+            return None
+        try:
+            with open(self._path(batch_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+batches = BatchRegistry()
+
+def folder_name(index, data):
+    """ZIP folder for one transaction, e.g. 003_deal-42/"""
+    label = re.sub(r"[^A-Za-z0-9_.-]+", "-", str(data.get("id") or "transaction")).strip("-.") or "transaction"
+    return f"{index + 1:03d}_{label}/"
+
+def stream_batch_zip(batch_id, transactions):
+    """Yield one ZIP with a folder per transaction, rendering every document on the shared pool.
+
+    transactions is a list of (data, documents). Each folder gets its own manifest.json
+    as soon as its last document is done; the top-level manifest.json comes last.
+    """
+    folders = [folder_name(i, data) for i, (data, _) in enumerate(transactions)]
+    remaining = [len(documents) for _, documents in transactions]
+    manifests = [{"generated": [], "failed": []} for _ in transactions]
+    jobs = (
+        (i, template_name, filename, label, data)
+        for i, (data, documents) in enumerate(transactions)
+        for template_name, filename, label in documents
+    )
+
+    sink = ZipStream()
+    # Stays "incomplete" if rendering raises or the client disconnects mid-stream
+    status = "incomplete"
+    try:
+        with zipfile.ZipFile(sink, "w") as zip_file:
+            for i, filename, label, content, error in iter_render_jobs(jobs):
+                if error is None:
+                    zip_file.writestr(folders[i] + filename, content)
+                    manifests[i]["generated"].append(filename)
+                    batches.update(batch_id, rendered=1)
+                else:
+                    manifests[i]["failed"].append({"document": filename, "label": label, "error": str(error)})
+                    batches.update(batch_id, failed=1)
+
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    zip_file.writestr(folders[i] + "manifest.json", json.dumps(manifests[i], indent=2))
+                    batches.update(batch_id, completed_transactions=1)
+                yield sink.drain()
+
+            zip_file.writestr("manifest.json", json.dumps({
+                "batch_id": batch_id,
+                "transactions": [
+                    {"folder": folder, **manifest} for folder, manifest in zip(folders, manifests)
+                ],
+            }, indent=2))
+        yield sink.drain()
+        status = "complete"
+    finally:
+        batches.finish(batch_id, status)
@@ -0,0 +1,275 @@
+# kit_builder.py
+import os
+import json
+import zipfile
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from docxtpl import DocxTemplate
+
+TEMPLATE_DIR = os.environ.get("KIT_TEMPLATE_DIR", "templates/transaction_autopilot")
+# Processes used to render kit documents in parallel; 0 renders inline
+KIT_WORKERS = int(os.environ.get("KIT_WORKERS", min(7, os.cpu_count() or 1)))
+
+# (template file, file name in the ZIP, label used in errors)
+KIT_DOCUMENTS = [
+    ("loi_template.docx", "Letter_of_Intent.docx", "LOI"),
+    ("psa_template.docx", "Purchase_Sale_Agreement.docx", "PSA"),
+    ("purchase_offer_template.docx", "Purchase_Offer.docx", "Purchase Offer"),
+    ("agency_disclosure_template.docx", "Agency_Disclosure.docx", "Agency Disclosure"),
+    ("real_estate_purchase_template.docx", "Real_Estate_Purchase_Agreement.docx", "Real Estate Purchase Agreement"),
+    ("lease_template.docx", "Lease_Agreement.docx", "Lease Agreement"),
+    ("seller_disclosure_template.docx", "Seller_Disclosure.docx", "Seller Disclosure"),
+]
+
+
+class TemplateRegistry:
+    """Keeps each .docx template's bytes in memory and renders a fresh DocxTemplate from them.
+
+    A template is re-read when its file's mtime changes. Every render parses its own
+    copy, so no state from one customer's render can reach the next; only the disk
+    read is shared.
+    """
+
+    def __init__(self, template_dir=TEMPLATE_DIR):
+        self.template_dir = template_dir
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def path(self, template_name):
+        return os.path.join(self.template_dir, template_name)
+
+    def source(self, template_name):
+        """Cached template bytes, reloaded if the file changed on disk"""
+        path = self.path(template_name)
+        mtime = os.path.getmtime(path)
+        entry = self.templates.get(template_name)
+        if entry is None or entry[0] != mtime:
+            with self.lock:
+                entry = self.templates.get(template_name)
+                if entry is None or entry[0] != mtime:
+                    with open(path, "rb") as f:
+                        entry = (mtime, f.read())
+                    self.templates[template_name] = entry
+        return entry[1]
+
+    def render(self, template_name, data):
+        """Render the template with data and return the .docx bytes"""
+        tpl = DocxTemplate(BytesIO(self.source(template_name)))
+        tpl.render(data)
+        bio = BytesIO()
+        tpl.save(bio)
+        return bio.getvalue()
+
+    def preload(self):
+        for template_name, _, label in KIT_DOCUMENTS:
+            try:
+                self.source(template_name)
+            except Exception as e:
+                print(f"Error loading {label} template: {e}")
+
+
+registry = TemplateRegistry()
+
+def preload_templates():
+    registry.preload()
+
+def template_versions(documents=KIT_DOCUMENTS):
+    """{template file: "mtime-size"} for the given documents, changing whenever a template is edited"""
+    versions = {}
+    for template_name, _, _ in documents:
+        try:
+            st = os.stat(registry.path(template_name))
+            versions[template_name] = f"{st.st_mtime_ns}-{st.st_size}"
+        except OSError:
+            versions[template_name] = None
+    return versions
+
+def render_document(template_name, data):
+    """Render one kit document from the cached template bytes and return it as a BytesIO"""
+    return BytesIO(render_document_bytes(template_name, data))
+
+def render_document_bytes(template_name, data):
+    """Picklable variant of render_document for the process pool"""
+    return registry.render(template_name, data)
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+    """Shared render pool; spawned (not forked) since the web worker is threaded"""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=KIT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=preload_templates
+            )
+        return pool
+
+def reset_pool(broken):
+    """Replace the broken executor, unless another caller already has; never touches a newer pool"""
+    global pool
+    with pool_lock:
+        if pool is broken:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
+
+def document_key(filename):
+    """Short name callers use to pick a document, e.g. letter_of_intent"""
+    return os.path.splitext(filename)[0].lower()
+
+def select_documents(names):
+    """KIT_DOCUMENTS entries matching names (document keys or labels, any case).
+
+    names may be a list or a comma-separated string; empty means the whole kit.
+    Raises ValueError for a name that matches no document.
+    """
+    if isinstance(names, str):
+        names = names.split(",")
+    wanted = [n.strip().lower() for n in names or [] if n and n.strip()]
+    if not wanted:
+        return KIT_DOCUMENTS
+    by_name = {}
+    for doc in KIT_DOCUMENTS:
+        _, filename, label = doc
+        by_name[document_key(filename)] = doc
+        by_name[label.lower()] = doc
+    unknown = [n for n in wanted if n not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown documents: {', '.join(unknown)}")
+    selected = {by_name[n] for n in wanted}
+    return [doc for doc in KIT_DOCUMENTS if doc in selected]
+
+def submit_render(template_name, data):
+    """Start rendering one document; returns (future resolving to its bytes, executor or None)"""
+    if KIT_WORKERS <= 0:
+        return InlineResult(render_document_bytes, template_name, data), None
+    executor = get_pool()
+    try:
+        return executor.submit(render_document_bytes, template_name, data), executor
+    except BrokenProcessPool:
+        reset_pool(executor)
+        executor = get_pool()
+        return executor.submit(render_document_bytes, template_name, data), executor
+
+
+class InlineResult:
+    """Future-like wrapper for rendering in the calling process"""
+
+    def __init__(self, fn, *args):
+        try:
+            self.value, self.error = fn(*args), None
+        except Exception as e:
+            self.value, self.error = None, e
+
+    def result(self, timeout=None):
+        if self.error:
+            raise self.error
+        return self.value
+
+def iter_render_jobs(jobs, max_pending=None):
+    """Render (tag, template, filename, label, data) jobs, yielding
+    (tag, filename, label, content, error) in completion order.
+
+    At most max_pending documents are in flight, so a long job list never has every
+    finished document waiting in memory for a slow consumer.
+    """
+    jobs = iter(jobs)
+    if KIT_WORKERS <= 0:
+        for tag, template_name, filename, label, data in jobs:
+            yield (tag, filename, label) + _outcome(label, InlineResult(render_document_bytes, template_name, data))
+        return
+
+    max_pending = max_pending or KIT_WORKERS * 4
+    pending = {}
+
+    def fill():
+        while len(pending) < max_pending:
+            job = next(jobs, None)
+            if job is None:
+                return
+            tag, template_name, filename, label, data = job
+            future, executor = submit_render(template_name, data)
+            pending[future] = (tag, filename, label, executor)
+
+    fill()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            tag, filename, label, executor = pending.pop(future)
+            yield (tag, filename, label) + _outcome(label, future, executor)
+        fill()
+
+def _outcome(label, future, executor=None):
+    try:
+        return future.result(), None
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool) and executor is not None:
+            reset_pool(executor)
+        print(f"Error generating {label}: {e}")
+        return None, e
+
+def iter_rendered(data, documents=KIT_DOCUMENTS):
+    """Yield (filename, label, content, error) as each document finishes rendering"""
+    jobs = [(None, template_name, filename, label, data) for template_name, filename, label in documents]
+    for _, filename, label, content, error in iter_render_jobs(jobs, max_pending=len(jobs)):
+        yield filename, label, content, error
+
+def render_kit(data, documents=KIT_DOCUMENTS):
+    """Render documents concurrently and return ([(filename, bytes)], manifest).
+
+    The manifest lists every generated file and, for each failure, the document and
+    the error, so partial kits are explained inside the ZIP.
+    """
+    rendered = []
+    manifest = {"generated": [], "failed": []}
+    for filename, label, content, error in iter_rendered(data, documents):
+        if error is None:
+            rendered.append((filename, content))
+            manifest["generated"].append(filename)
+        else:
+            manifest["failed"].append({"document": filename, "label": label, "error": str(error)})
+    return rendered, manifest
+
+
+class ZipStream:
+    """Write-only, non-seekable sink for zipfile; drain() hands back what was written"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_kit_zip(data, documents=KIT_DOCUMENTS):
+    """Yield a ZIP of the kit chunk by chunk, adding each document as soon as it renders.
+
+    Nothing but the document currently being written is held in memory. manifest.json
+    is written last, once every document has succeeded or failed.
+    """
+    sink = ZipStream()
+    manifest = {"generated": [], "failed": []}
+    with zipfile.ZipFile(sink, "w") as zip_file:
+        for filename, label, content, error in iter_rendered(data, documents):
+            if error is None:
+                zip_file.writestr(filename, content)
+                manifest["generated"].append(filename)
+            else:
+                manifest["failed"].append({"document": filename, "label": label, "error": str(error)})
+            yield sink.drain()
+        zip_file.writestr("manifest.json", json.dumps(manifest, indent=2))
+    yield sink.drain()
@@ -0,0 +1,147 @@
+# kit_cache.py
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import zipfile
+
+from kit_builder import template_versions
+
+KIT_CACHE_DIR = os.environ.get("KIT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "closing_kit_cache"))
+# Set KIT_CACHE_MAX_BYTES=0 to turn the cache off
+KIT_CACHE_MAX_BYTES = int(os.environ.get("KIT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+KIT_CACHE_MAX_ENTRIES = int(os.environ.get("KIT_CACHE_MAX_ENTRIES", 1000))
+
+
+def normalize_value(value):
+    """Trim leading/trailing whitespace in strings so trivially different resubmits share an entry.
+
+    The kit must be rendered from the normalized data, since that is what gets hashed.
+    Inner whitespace is kept: line breaks in a field show up in the documents.
+    """
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {k: normalize_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalize_value(v) for v in value]
+    return value
+
+
+class KitCache:
+    """Content-addressed on-disk store of finished closing-kit ZIPs.
+
+    Entries are keyed by a hash of the form data as rendered (normalized, defaults applied), the
+    selected documents and the template versions, so editing a template retires its
+    old kits. The directory is shared by every worker: a hit touches the file's mtime
+    and eviction removes the least recently used files until the store is back under
+    KIT_CACHE_MAX_BYTES and KIT_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(self, cache_dir=KIT_CACHE_DIR, max_bytes=KIT_CACHE_MAX_BYTES, max_entries=KIT_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def key(self, data, documents):
+        payload = json.dumps({
+            "data": data,
+            "documents": [filename for _, filename, _ in documents],
+            "templates": template_versions(documents),
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.zip")
+
+    def get(self, key):
+        """Path of the cached ZIP for key, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, chunks):
+        """Pass ZIP chunks through while writing them to the cache.
+
+        Only complete kits with no failed documents are kept; a partial write (client
+        gone, render error) is discarded.
+        """
+        if not self.enabled:
+            yield from chunks
+            return
+
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            if self._complete(tmp_path):
+                os.replace(tmp_path, self._path(key))
+                self._evict()
+        except OSError as e:
+            print(f"Error writing kit cache entry: {str(e)}")
+        finally:
+            self._remove(tmp_path)
+
+    def _complete(self, path):
+        try:
+            with zipfile.ZipFile(path) as zip_file:
+                return not json.loads(zip_file.read("manifest.json"))["failed"]
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return False
+
+    def _evict(self):
+        """Drop least recently used entries until the store fits its limits"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(".zip"):
+                entries.append((st.st_mtime, st.st_size, path))
+            elif name.endswith(".tmp") and st.st_mtime < time.time() - 3600:
+                # Left behind by a worker that died mid-write
+                self._remove(path)
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, path = entries.pop(0)
+            self._remove(path)
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+kit_cache = KitCache()
@@ -0,0 +1,130 @@
+# model_router.py
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests import HTTPError
+
+BREAKER_COOLDOWN = float(os.environ.get("MODEL_BREAKER_COOLDOWN", 60))
+BREAKER_THRESHOLD = int(os.environ.get("MODEL_BREAKER_THRESHOLD", 3))
+# Hedge delay used until a model has enough latency samples for a p90
+HEDGE_DEFAULT_DELAY = float(os.environ.get("MODEL_HEDGE_DEFAULT_DELAY", 8))
+HEDGE_MIN_DELAY = float(os.environ.get("MODEL_HEDGE_MIN_DELAY", 1))
+LATENCY_SAMPLES = 50
+
+
+class ModelRouter:
+    """Routes completions across GH_MODELS entries.
+
+    Each model has a circuit breaker: a 429 opens it for the Retry-After period (or
+    BREAKER_COOLDOWN), a 404 for ten cooldowns, and BREAKER_THRESHOLD consecutive other
+    failures for one cooldown. Open models are skipped. If the first model hasn't
+    answered within its p90 latency, a hedged request goes to the next model and the
+    first successful answer wins.
+    """
+
+    def __init__(self, call, max_workers=8):
+        self.call = call
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.open_until = {}
+        self.failures = {}
+        self.latencies = {}
+
+    def available_models(self, models):
+        now = time.monotonic()
+        with self.lock:
+            return [m for m in models if self.open_until.get(m, 0) <= now]
+
+    def hedge_delay(self, model):
+        """p90 of recent successful latencies for a model"""
+        with self.lock:
+            samples = sorted(self.latencies.get(model, ()))
+        if len(samples) < 5:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, samples[int(len(samples) * 0.9) - 1])
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                model: {
+                    "open_for": max(0, round(self.open_until.get(model, 0) - now, 1)),
+                    "failures": self.failures.get(model, 0),
+                    "samples": len(self.latencies.get(model, ())),
+                }
+                for model in set(self.open_until) | set(self.latencies)
+            }
+
+    def record_success(self, model, latency):
+        with self.lock:
+            self.failures[model] = 0
+            self.latencies.setdefault(model, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+
+    def record_failure(self, model, error):
+        cooldown = None
+        status = error.response.status_code if isinstance(error, HTTPError) and error.response is not None else None
+        with self.lock:
+            self.failures[model] = self.failures.get(model, 0) + 1
+            if status == 429:
+                retry_after = error.response.headers.get("Retry-After", "")
+                cooldown = float(retry_after) if retry_after.isdigit() else BREAKER_COOLDOWN
+            elif status == 404:
+                cooldown = BREAKER_COOLDOWN * 10
+            elif self.failures[model] >= BREAKER_THRESHOLD:
+                cooldown = BREAKER_COOLDOWN
+            if cooldown:
+                self.open_until[model] = time.monotonic() + cooldown
+
+    def _timed_call(self, model, prompt, timeout):
+        started = time.monotonic()
+        try:
+            result = self.call(model, prompt, timeout)
+        except Exception as e:
+            self.record_failure(model, e)
+            raise
+        self.record_success(model, time.monotonic() - started)
+        return result
+
+    def complete(self, models, prompt, timeout):
+        """Return the first successful completion, hedging across models"""
+        candidates = self.available_models(models)
+        deadline = time.monotonic() + timeout
+        pending = {}
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            model = candidates[next_index]
+            next_index += 1
+            remaining = max(1, deadline - time.monotonic())
+            pending[self.executor.submit(self._timed_call, model, prompt, remaining)] = model
+
+        if candidates:
+            launch()
+        while pending:
+            wait_for = deadline - time.monotonic()
+            if wait_for <= 0:
+                break
+            if next_index < len(candidates):
+                wait_for = min(wait_for, self.hedge_delay(candidates[next_index - 1]))
+
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                # The in-flight request is slower than its p90; hedge with the next model
+                if next_index < len(candidates):
+                    launch()
+                continue
+
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    print(f"Error with model {model}: {str(e)}")
+            # Fall through to the next model as soon as one fails
+            if next_index < len(candidates):
+                launch()
+
+        raise RuntimeError("All models failed or were rate‑limited")
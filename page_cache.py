@@ -0,0 +1,82 @@
+# page_cache.py
+import os
+import gzip
+import hashlib
+import threading
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PAGE_CACHE_MAX_AGE = int(os.environ.get("PAGE_CACHE_MAX_AGE", 300))
+# Compressing tiny pages costs more than it saves
+PAGE_COMPRESS_MIN_BYTES = 512
+
+
+class PageCache:
+    """Static pages rendered once at startup and kept with precompressed variants.
+
+    Each variant (identity, gzip, br) gets its own strong ETag so If-None-Match
+    revalidation works whatever encoding the client negotiated.
+    """
+
+    def __init__(self, max_age=PAGE_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def fill(self, app):
+        """Render every top-level .html template of app"""
+        pages = {}
+        names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith(".html") and "/" not in name)
+        for name in names:
+            page = name[:-len(".html")]
+            try:
+                with app.test_request_context(f"/{page}"):
+                    body = app.jinja_env.get_template(name).render().encode("utf-8")
+            except Exception as e:
+                print(f"Error rendering page {page}: {e}")
+                continue
+            pages[page] = self._variants(body)
+        with self.lock:
+            self.pages = pages
+        print(f"Page cache filled with {len(pages)} pages")
+
+    def _variants(self, body):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {"identity": (body, digest)}
+        if len(body) >= PAGE_COMPRESS_MIN_BYTES:
+            variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f"{digest}-gz")
+            if brotli is not None:
+                variants["br"] = (brotli.compress(body, quality=11), f"{digest}-br")
+        return variants
+
+    def response(self, page):
+        """Response for a cached page, or None if there is no such page"""
+        variants = self.pages.get(page)
+        if variants is None:
+            return None
+
+        encoding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        body, etag = variants[encoding]
+
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(body, 200)
+            response.mimetype = "text/html"
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"public, max-age={self.max_age}"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+page_cache = PageCache()
@@ -1,20 +1,30 @@
 # public.py
 
 import os
-import zipfile
+import json
 import tempfile
 import uuid
-from io import BytesIO
 
-from flask import Blueprint, request, send_file, jsonify, render_template, abort
+from flask import Blueprint, Response, request, send_file, jsonify, stream_with_context
 from flask_cors import CORS
-from docxtpl import DocxTemplate
+from downloads import attachment_headers
+from kit_builder import preload_templates, select_documents, stream_kit_zip
+from kit_cache import kit_cache, normalize_value
+from kit_batch import KIT_BATCH_MAX, batches, stream_batch_zip
+from page_cache import page_cache
+from bulkhead import ai_bulkhead
+from reply_service import generate_reply
 
 public_bp = Blueprint("public", __name__)
+
+# Parse the closing-kit templates once at startup
+preload_templates()
+
 # Allow CORS for demo endpoints
-CORS(public_bp, resources={r"/api/*": {"origins": "*"}})
+CORS(public_bp, resources={r"/api/*": {"origins": "*"}}, expose_headers=["X-Batch-Id", "X-Kit-Cache"])
 
 @public_bp.route("/api/generate-reply-prompt", methods=["OPTIONS", "POST"])
+@ai_bulkhead.limit
 def generate_reply_prompt():
     if request.method == "OPTIONS":
         return ("", 204)
@@ -24,82 +34,48 @@ def generate_reply_prompt():
     if not prompt:
         return jsonify({"error": "Missing prompt"}), 400
 
-    # Enhanced prompt to generate reply and three follow-ups
-    enhanced_prompt = f"""
-    Generate a professional reply to the following email, and then generate three follow-up emails that would be sent later.
-    Format your response exactly as follows:
-
-    === REPLY ===
-    [Your main reply here]
-
-    === FOLLOW UP 1 ===
-    [First follow-up email]
-
-    === FOLLOW UP 2 ===
-    [Second follow-up email]
-
-    === FOLLOW UP 3 ===
-    [Third follow-up email]
-
-    Email to respond to:
-    {prompt}
-    """
-
     try:
-        from utils import callAIML_from_flask
-        full_response = callAIML_from_flask(enhanced_prompt)
-        
-        # Parse the response to extract reply and follow-ups
-        sections = {}
-        current_section = None
-        lines = full_response.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if line == "=== REPLY ===":
-                current_section = 'reply'
-                sections[current_section] = []
-            elif line == "=== FOLLOW UP 1 ===":
-                current_section = 'follow_up_1'
-                sections[current_section] = []
-            elif line == "=== FOLLOW UP 2 ===":
-                current_section = 'follow_up_2'
-                sections[current_section] = []
-            elif line == "=== FOLLOW UP 3 ===":
-                current_section = 'follow_up_3'
-                sections[current_section] = []
-            elif current_section and line:
-                sections[current_section].append(line)
-        
-        # Join the lines for each section
-        reply = ' '.join(sections.get('reply', [])).strip()
-        follow_ups = [
-            ' '.join(sections.get('follow_up_1', [])).strip(),
-            ' '.join(sections.get('follow_up_2', [])).strip(),
-            ' '.join(sections.get('follow_up_3', [])).strip()
-        ]
-        
-        # Remove any empty follow-ups
-        follow_ups = [fu for fu in follow_ups if fu]
-        
-        return jsonify({
-            "reply": reply,
-            "follow_ups": follow_ups
-        })
+        return jsonify(generate_reply(prompt, timeout=300))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 
+@public_bp.record_once
+def fill_page_cache(state):
+    # Render the static marketing and demo pages once, when the blueprint is registered
+    page_cache.fill(state.app)
+
 @public_bp.route("/<path:page>")
 def catch_all(page):
     # don’t try to render static assets
     if page in ("signin", "favicon.ico"):
-        abort(404)
-    return render_template(f"{page}.html")
+        return ("Not Found", 404)
+    # Only pages rendered into the cache exist; anything else is a 404 without touching Jinja
+    response = page_cache.response(page)
+    if response is None:
+        return ("Not Found", 404)
+    return response
 
 #--------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+# Values used for any closing-kit field the caller leaves out or empty
+KIT_DEFAULTS = {
+    "transaction_type": "Purchase",
+    "rent_type": "Annual Lease",
+    "inspection_days": 10,
+    "mortgage_years": 30,
+    "interest_rate": 3.5,
+    "parking_spaces": 1,
+    "broker_name": "John Smith",
+}
+
+def apply_kit_defaults(data):
+    for key, value in KIT_DEFAULTS.items():
+        if key not in data or not data[key]:
+            data[key] = value
+    return data
+
 @public_bp.route("/api/generate-full-kit", methods=["OPTIONS", "POST"])
 def generate_full_kit():
     if request.method == "OPTIONS":
@@ -107,117 +83,92 @@ def generate_full_kit():
 
     try:
         data = request.get_json(force=True)
-        
-        # Set default values for any missing fields
-        defaults = {
-            "transaction_type": "Purchase",
-            "rent_type": "Annual Lease",
-            "inspection_days": 10,
-            "mortgage_years": 30,
-            "interest_rate": 3.5,
-            "parking_spaces": 1,
-            "broker_name": "John Smith",
-        }
-        
-        for key, value in defaults.items():
-            if key not in data or not data[key]:
-                data[key] = value
-        
-        # Generate all documents
-        documents = []
-        
-        # LOI
-        try:
-            loi_tpl = DocxTemplate("templates/transaction_autopilot/loi_template.docx")
-            loi_tpl.render(data)
-            loi_bio = BytesIO()
-            loi_tpl.save(loi_bio)
-            loi_bio.seek(0)
-            documents.append(("Letter_of_Intent.docx", loi_bio))
-        except Exception as e:
-            print(f"Error generating LOI: {e}")
-        
-        # PSA
-        try:
-            psa_tpl = DocxTemplate("templates/transaction_autopilot/psa_template.docx")
-            psa_tpl.render(data)
-            psa_bio = BytesIO()
-            psa_tpl.save(psa_bio)
-            psa_bio.seek(0)
-            documents.append(("Purchase_Sale_Agreement.docx", psa_bio))
-        except Exception as e:
-            print(f"Error generating PSA: {e}")
-        
-        # Purchase Offer
-        try:
-            purchase_offer_tpl = DocxTemplate("templates/transaction_autopilot/purchase_offer_template.docx")
-            purchase_offer_tpl.render(data)
-            purchase_offer_bio = BytesIO()
-            purchase_offer_tpl.save(purchase_offer_bio)
-            purchase_offer_bio.seek(0)
-            documents.append(("Purchase_Offer.docx", purchase_offer_bio))
-        except Exception as e:
-            print(f"Error generating Purchase Offer: {e}")
-        
-        # Agency Disclosure
-        try:
-            agency_tpl = DocxTemplate("templates/transaction_autopilot/agency_disclosure_template.docx")
-            agency_tpl.render(data)
-            agency_bio = BytesIO()
-            agency_tpl.save(agency_bio)
-            agency_bio.seek(0)
-            documents.append(("Agency_Disclosure.docx", agency_bio))
-        except Exception as e:
-            print(f"Error generating Agency Disclosure: {e}")
-        
-        # Real Estate Purchase Agreement
-        try:
-            purchase_tpl = DocxTemplate("templates/transaction_autopilot/real_estate_purchase_template.docx")
-            purchase_tpl.render(data)
-            purchase_bio = BytesIO()
-            purchase_tpl.save(purchase_bio)
-            purchase_bio.seek(0)
-            documents.append(("Real_Estate_Purchase_Agreement.docx", purchase_bio))
-        except Exception as e:
-            print(f"Error generating Real Estate Purchase Agreement: {e}")
-        
-        # Lease Agreement
-        try:
-            lease_tpl = DocxTemplate("templates/transaction_autopilot/lease_template.docx")
-            lease_tpl.render(data)
-            lease_bio = BytesIO()
-            lease_tpl.save(lease_bio)
-            lease_bio.seek(0)
-            documents.append(("Lease_Agreement.docx", lease_bio))
-        except Exception as e:
-            print(f"Error generating Lease Agreement: {e}")
-        
-        # Seller Disclosure
+
+        # Optional subset of the kit, e.g. ["letter_of_intent", "PSA"] or ?documents=loi,psa
         try:
-            seller_tpl = DocxTemplate("templates/transaction_autopilot/seller_disclosure_template.docx")
-            seller_tpl.render(data)
-            seller_bio = BytesIO()
-            seller_tpl.save(seller_bio)
-            seller_bio.seek(0)
-            documents.append(("Seller_Disclosure.docx", seller_bio))
-        except Exception as e:
-            print(f"Error generating Seller Disclosure: {e}")
-
-        # Create a ZIP file in memory
-        zip_io = BytesIO()
-        with zipfile.ZipFile(zip_io, 'w') as zip_file:
-            for filename, file_bio in documents:
-                zip_file.writestr(filename, file_bio.getvalue())
-        
-        zip_io.seek(0)
-        
-        return send_file(
-            zip_io,
-            as_attachment=True,
-            download_name=f"complete_closing_kit_{data.get('id', 'demo')}.zip",
-            mimetype="application/zip"
+            documents = select_documents(data.pop("documents", None) or request.args.get("documents"))
+        except ValueError as e:
+            return jsonify({"error": "invalid_documents", "detail": str(e)}), 400
+
+        # Render from exactly the data the cache key is computed from
+        data = apply_kit_defaults(normalize_value(data))
+
+        filename = f"complete_closing_kit_{data.get('id', 'demo')}.zip"
+
+        # Identical requests get the kit rendered last time
+        cache_key = kit_cache.key(data, documents)
+        cached_path = kit_cache.get(cache_key)
+        if cached_path:
+            response = send_file(cached_path, as_attachment=True, download_name=filename, mimetype="application/zip")
+            response.headers["X-Kit-Cache"] = "hit"
+            return response
+
+        # Stream the ZIP, adding each document as soon as it renders, and cache it on the way out
+        headers = attachment_headers(filename)
+        headers["X-Kit-Cache"] = "miss"
+        return Response(
+            stream_with_context(kit_cache.store(cache_key, stream_kit_zip(data, documents))),
+            mimetype="application/zip",
+            headers=headers
         )
         
     except Exception as e:
         print(f"Error in generate_full_kit: {e}")
         return jsonify({"error": str(e)}), 500
+
+
+def parse_batch_payloads(body):
+    """Transaction payloads from a JSON array, {"transactions": [...]} or NDJSON"""
+    text = body.strip()
+    if not text:
+        return []
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        # Not one JSON document, so one transaction per line
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(parsed, dict):
+        # A single NDJSON line parses as one object too
+        return parsed["transactions"] if "transactions" in parsed else [parsed]
+    return parsed
+
+@public_bp.route("/api/generate-kit-batch", methods=["OPTIONS", "POST"])
+def generate_kit_batch():
+    if request.method == "OPTIONS":
+        return ("", 204)
+
+    try:
+        payloads = parse_batch_payloads(request.get_data(as_text=True))
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": "invalid_batch", "detail": f"Expected a JSON array or NDJSON of transactions: {e}"}), 400
+    if not isinstance(payloads, list) or not payloads:
+        return jsonify({"error": "invalid_batch", "detail": "No transactions in request"}), 400
+    if len(payloads) > KIT_BATCH_MAX:
+        return jsonify({"error": "batch_too_large", "detail": f"At most {KIT_BATCH_MAX} transactions per batch"}), 413
+
+    # Each transaction may pick its own documents; ?documents= sets the default for the batch
+    transactions = []
+    try:
+        batch_documents = select_documents(request.args.get("documents"))
+        for i, data in enumerate(payloads):
+            if not isinstance(data, dict):
+                return jsonify({"error": "invalid_batch", "detail": f"Transaction {i + 1} is not an object"}), 400
+            names = data.pop("documents", None)
+            documents = select_documents(names) if names else batch_documents
+            transactions.append((apply_kit_defaults(normalize_value(data)), documents))
+    except ValueError as e:
+        return jsonify({"error": "invalid_documents", "detail": str(e)}), 400
+
+    batch_id = batches.create(len(transactions), sum(len(documents) for _, documents in transactions))
+    return Response(
+        stream_with_context(stream_batch_zip(batch_id, transactions)),
+        mimetype="application/zip",
+        headers={**attachment_headers(f"closing_kits_{batch_id}.zip"), "X-Batch-Id": batch_id}
+    )
+
+@public_bp.route("/api/generate-kit-batch/<batch_id>", methods=["GET"])
+def kit_batch_status(batch_id):
+    batch = batches.get(batch_id)
+    if not batch:
+        return jsonify({"error": "not_found", "detail": "Unknown batch"}), 404
+    return jsonify(batch)
@@ -0,0 +1,167 @@
+# reply_service.py
+import os
+import re
+import hashlib
+from utils import complete, stream_completion
+
+# Matches the section markers the prompt asks for, e.g. "=== FOLLOW UP 2 ==="
+SECTION_PATTERN = re.compile(r"^[ \t]*=== (REPLY|FOLLOW UP [123]) ===[ \t\r]*$", re.MULTILINE)
+SECTION_NAMES = {
+    "REPLY": "reply",
+    "FOLLOW UP 1": "follow_up_1",
+    "FOLLOW UP 2": "follow_up_2",
+    "FOLLOW UP 3": "follow_up_3",
+}
+FOLLOW_UP_SECTIONS = ("follow_up_1", "follow_up_2", "follow_up_3")
+
+def build_reply_prompt(prompt):
+    """Prompt asking for a reply and three follow-ups in marked sections"""
+    return f"""
+    Generate a professional real estate agent reply to the following email, and then generate three follow-up emails that would be sent later.
+    Format your response exactly as follows:
+
+    === REPLY ===
+    [Your main reply here]
+
+    === FOLLOW UP 1 ===
+    [First follow-up email]
+
+    === FOLLOW UP 2 ===
+    [Second follow-up email]
+
+    === FOLLOW UP 3 ===
+    [Third follow-up email]
+
+    Email to respond to:
+    {prompt}
+    """
+
+def join_section(text):
+    """Collapse a section's non-empty lines into one paragraph"""
+    return ' '.join(line.strip() for line in text.splitlines() if line.strip())
+
+def parse_sections(full_response):
+    """Split a completion into {section name: text}; a repeated marker replaces the earlier section"""
+    sections = {}
+    markers = list(SECTION_PATTERN.finditer(full_response))
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(full_response)
+        sections[SECTION_NAMES[marker.group(1)]] = join_section(full_response[marker.end():end])
+    return sections
+
+def sections_to_reply(sections):
+    """Shape parsed sections into the API response, dropping empty follow-ups"""
+    follow_ups = [sections.get(name, '') for name in FOLLOW_UP_SECTIONS]
+    return {
+        "reply": sections.get('reply', ''),
+        "follow_ups": [fu for fu in follow_ups if fu]
+    }
+
+
+class SectionStreamParser:
+    """Incrementally split streamed model output into REPLY / FOLLOW UP sections.
+
+    feed() returns the sections completed by the new text as (name, content) pairs;
+    a section completes when the next marker arrives or close() is called.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.current = None
+        self.lines = []
+
+    def feed(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        completed = []
+        for line in lines:
+            completed.extend(self._line(line))
+        return completed
+
+    def close(self):
+        completed = self._line(self.buffer)
+        self.buffer = ""
+        completed.extend(self._finish())
+        self.current = None
+        return completed
+
+    def _line(self, line):
+        marker = SECTION_PATTERN.fullmatch(line)
+        if marker:
+            completed = self._finish()
+            self.current = SECTION_NAMES[marker.group(1)]
+            self.lines = []
+            return completed
+        if self.current and line.strip():
+            self.lines.append(line.strip())
+        return []
+
+    def _finish(self):
+        if not self.current:
+            return []
+        return [(self.current, ' '.join(self.lines))]
+
+
+class GitHubModelsBackend:
+    """Completions from GitHub Models via the shared router, cache and HTTP pool"""
+
+    def complete(self, prompt, timeout):
+        return complete(prompt, timeout=timeout)
+
+    def stream(self, prompt, timeout):
+        return stream_completion(prompt, timeout=timeout)
+
+
+class StubBackend:
+    """Deterministic local completions for tests and benchmarks; never leaves the process"""
+
+    def complete(self, prompt, timeout):
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+        return "\n".join([
+            "=== REPLY ===",
+            f"Thanks for reaching out! (ref {digest})",
+            "=== FOLLOW UP 1 ===",
+            "Just following up on my last message.",
+            "=== FOLLOW UP 2 ===",
+            "Checking in again in case you have questions.",
+            "=== FOLLOW UP 3 ===",
+            "Final follow-up, let me know if you're still interested.",
+        ])
+
+    def stream(self, prompt, timeout):
+        text = self.complete(prompt, timeout)
+        for i in range(0, len(text), 16):
+            yield text[i:i+16]
+
+
+BACKENDS = {"github": GitHubModelsBackend, "stub": StubBackend}
+backend = BACKENDS[os.environ.get("REPLY_BACKEND", "github")]()
+
+def generate_reply(prompt, timeout=30):
+    """Reply plus follow-ups for an email; raises if no model could answer"""
+    full_response = backend.complete(build_reply_prompt(prompt), timeout)
+    if not full_response:
+        raise RuntimeError("All models failed or were rate-limited")
+    return sections_to_reply(parse_sections(full_response))
+
+def stream_reply_sections(prompt, timeout=30):
+    """Yield (section, content) pairs as each section of the streamed reply completes"""
+    parser = SectionStreamParser()
+    for text in backend.stream(build_reply_prompt(prompt), timeout):
+        for section, content in parser.feed(text):
+            if content:
+                yield section, content
+    for section, content in parser.close():
+        if content:
+            yield section, content
+
+def generate_fallback_response(prompt):
+    """Generate a simple fallback response when the AI service is unavailable"""
+    return {
+        "reply": f"Hi there! Thanks for your message about the open house. I'd be happy to help you with your real estate needs. When were you thinking of coming by for a viewing?",
+        "follow_ups": [
+            "Just following up on your interest in our open house. Did you have a chance to think about scheduling a viewing?",
+            "I wanted to check in again about the property. We've had quite a bit of interest, so let me know if you'd like me to hold a specific time for you!",
+            "Final follow-up about the property. We're finalizing viewings this week, so please let me know if you're still interested."
+        ]
+    }
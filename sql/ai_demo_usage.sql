@@ -0,0 +1,57 @@
+-- Atomic AI demo usage counters, called by /api/record-ai-usage.
+-- Requires ai_demo_usage.email to be unique.
+
+-- The old read-then-insert path could race and leave several rows per email. Fold
+-- them into the earliest row (summed count, earliest first use, latest last use) and
+-- delete the rest before adding the unique index, which would otherwise fail on them.
+-- One statement, so the delete and the update see the same snapshot.
+begin;
+
+with totals as (
+    select email,
+           sum(usage_count) as usage_count,
+           min(first_used_at) as first_used_at,
+           max(last_used_at) as last_used_at
+    from ai_demo_usage
+    group by email
+    having count(*) > 1
+),
+ranked as (
+    select ctid as row_id, email,
+           row_number() over (partition by email order by first_used_at nulls last) as rn
+    from ai_demo_usage
+    where email in (select email from totals)
+),
+removed as (
+    delete from ai_demo_usage u
+    using ranked r
+    where u.ctid = r.row_id and r.rn > 1
+)
+update ai_demo_usage u
+    set usage_count = t.usage_count,
+        first_used_at = t.first_used_at,
+        last_used_at = t.last_used_at
+from ranked r
+join totals t on t.email = r.email
+where u.ctid = r.row_id and r.rn = 1;
+
+create unique index if not exists ai_demo_usage_email_key on ai_demo_usage (email);
+
+commit;
+
+-- usage: [{"lead_id": 123, "count": 2}, ...]. Looks up each lead's email and
+-- upsert-increments its row in one statement; unknown leads are skipped.
+create or replace function record_ai_usage(usage jsonb)
+returns table (lead_id bigint, email text, usage_count bigint)
+language sql
+as $$
+    insert into ai_demo_usage as u (lead_id, email, usage_count, first_used_at, last_used_at)
+    select l.id, l.email, sum((x->>'count')::bigint), now(), now()
+    from jsonb_array_elements(usage) x
+    join leads l on l.id = (x->>'lead_id')::bigint
+    group by l.id, l.email
+    on conflict (email) do update
+        set usage_count = u.usage_count + excluded.usage_count,
+            last_used_at = excluded.last_used_at
+    returning u.lead_id, u.email, u.usage_count::bigint;
+$$;
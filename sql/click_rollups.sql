@@ -0,0 +1,87 @@
+-- Incremental click analytics, updated by apply_click_rollups() each time the
+-- app flushes a batch of clicks into link_clicks.
+
+create table if not exists click_rollups (
+    campaign_id bigint not null,
+    bucket text not null,        -- 'total', 'unique', 'url' or 'hour'
+    bucket_key text not null,    -- '' for total/unique, the URL, or the UTC hour
+    clicks bigint not null default 0,
+    primary key (campaign_id, bucket, bucket_key)
+);
+
+create table if not exists campaign_clickers (
+    campaign_id bigint not null,
+    lead_id bigint not null,
+    first_clicked_at timestamptz not null default now(),
+    primary key (campaign_id, lead_id)
+);
+
+create or replace function apply_click_rollups(clicks jsonb)
+returns void
+language plpgsql
+as $$
+begin
+    insert into click_rollups (campaign_id, bucket, bucket_key, clicks)
+    select (c->>'campaign_id')::bigint, b.bucket, b.bucket_key, count(*)
+    from jsonb_array_elements(clicks) c
+    cross join lateral (values
+        ('total', ''),
+        ('url', coalesce(c->>'url', '')),
+        ('hour', to_char(date_trunc('hour', (c->>'clicked_at')::timestamptz at time zone 'UTC'), 'YYYY-MM-DD"T"HH24:00:00"Z"'))
+    ) as b(bucket, bucket_key)
+    where c->>'campaign_id' is not null
+    group by 1, 2, 3
+    on conflict (campaign_id, bucket, bucket_key)
+    do update set clicks = click_rollups.clicks + excluded.clicks;
+
+    with new_clickers as (
+        insert into campaign_clickers (campaign_id, lead_id)
+        select distinct (c->>'campaign_id')::bigint, (c->>'lead_id')::bigint
+        from jsonb_array_elements(clicks) c
+        where c->>'campaign_id' is not null and c->>'lead_id' is not null
+        on conflict do nothing
+        returning campaign_id
+    )
+    insert into click_rollups (campaign_id, bucket, bucket_key, clicks)
+    select campaign_id, 'unique', '', count(*)
+    from new_clickers
+    group by campaign_id
+    on conflict (campaign_id, bucket, bucket_key)
+    do update set clicks = click_rollups.clicks + excluded.clicks;
+end;
+$$;
+
+-- Backfill: rebuild the rollups and clicker list from link_clicks, so campaigns with
+-- clicks from before this migration (or rollups that drifted) report correct totals.
+-- Idempotent; re-running recomputes the same numbers. The exclusive locks hold off
+-- apply_click_rollups() until the rebuild commits.
+begin;
+
+lock table click_rollups, campaign_clickers in exclusive mode;
+
+delete from click_rollups;
+delete from campaign_clickers;
+
+insert into click_rollups (campaign_id, bucket, bucket_key, clicks)
+select lc.campaign_id, b.bucket, b.bucket_key, count(*)
+from link_clicks lc
+cross join lateral (values
+    ('total', ''),
+    ('url', coalesce(lc.url, '')),
+    ('hour', to_char(date_trunc('hour', lc.clicked_at::timestamptz at time zone 'UTC'), 'YYYY-MM-DD"T"HH24:00:00"Z"'))
+) as b(bucket, bucket_key)
+where lc.campaign_id is not null
+group by 1, 2, 3;
+
+insert into campaign_clickers (campaign_id, lead_id, first_clicked_at)
+select lc.campaign_id, lc.lead_id, coalesce(min(lc.clicked_at::timestamptz), now())
+from link_clicks lc
+where lc.campaign_id is not null and lc.lead_id is not null
+group by 1, 2;
+
+insert into click_rollups (campaign_id, bucket, bucket_key, clicks)
+select campaign_id, 'unique', '', count(*)
+from campaign_clickers
+group by campaign_id;
+
+commit;
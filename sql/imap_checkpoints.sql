@@ -0,0 +1,6 @@
+-- Per-account IMAP sync checkpoint used by check_replies.py.
+-- A run only looks at UIDs above imap_last_uid while the mailbox's UIDVALIDITY
+-- still matches imap_uidvalidity; otherwise it rescans a short lookback window.
+
+alter table smtp_accounts add column if not exists imap_uidvalidity bigint;
+alter table smtp_accounts add column if not exists imap_last_uid bigint;
@@ -0,0 +1,4 @@
+-- Content hash of each lead as last imported, written by /api/leads/import so
+-- mode=delta can skip rows that haven't changed.
+
+alter table leads add column if not exists content_hash text;
@@ -0,0 +1,35 @@
+-- Records replies found by check_replies.py in one transaction.
+
+-- lead_ids: leads whose address sent a reply. Leads already marked responded are
+-- skipped, so repeat replies don't add more responded_leads rows. Returns the
+-- leads marked by this call.
+create or replace function mark_leads_responded(lead_ids bigint[])
+returns table (lead_id bigint, email text)
+language plpgsql
+as $$
+declare
+    new_ids bigint[];
+begin
+    select array_agg(l.id) into new_ids
+    from leads l
+    where l.id = any(lead_ids) and not coalesce(l.responded, false);
+
+    if new_ids is null then
+        return;
+    end if;
+
+    insert into responded_leads (original_lead_id, email, name, last_name, city, brokerage, service, list_name, custom_fields)
+    select l.id, l.email, l.name, l.last_name, l.city, l.brokerage, l.service, l.list_name, l.custom_fields
+    from leads l
+    where l.id = any(new_ids);
+
+    delete from email_queue q where q.lead_id = any(new_ids);
+    delete from lead_campaign_accounts a where a.lead_id = any(new_ids);
+
+    return query
+    update leads l
+        set responded = true, responded_at = now()
+    where l.id = any(new_ids)
+    returning l.id::bigint, l.email::text;
+end;
+$$;
@@ -0,0 +1,9 @@
+-- Credential verification results written by /api/smtp-accounts and
+-- /api/smtp-accounts/<id>/verify. worker.py skips accounts whose status is
+-- 'failed' or 'pending_verification'; existing accounts keep a null status.
+
+alter table smtp_accounts add column if not exists verification_status text;
+alter table smtp_accounts add column if not exists verification_error text;
+alter table smtp_accounts add column if not exists verified_at timestamptz;
+alter table smtp_accounts add column if not exists smtp_latency_ms integer;
+alter table smtp_accounts add column if not exists imap_latency_ms integer;
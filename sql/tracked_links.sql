@@ -0,0 +1,14 @@
+-- Links of each queued email, resolved by the signed /t/<token> click route.
+-- Written by the campaign endpoints and backfilled by worker.py with
+-- upsert(on_conflict="email_queue_id,link_index"), which needs the unique constraint.
+
+create table if not exists tracked_links (
+    id bigserial primary key,
+    email_queue_id bigint not null,
+    link_index integer not null,
+    url text not null,
+    lead_id bigint,
+    campaign_id bigint,
+    created_at timestamptz not null default now(),
+    constraint tracked_links_email_queue_id_link_index_key unique (email_queue_id, link_index)
+);
@@ -0,0 +1,94 @@
+# tracking.py
+import os
+import re
+import hmac
+import base64
+import hashlib
+import urllib.parse
+
+# Tracking links are signed with a key derived from ENCRYPTION_KEY unless TRACKING_SECRET is set
+TRACKING_KEY = hashlib.sha256(
+    os.environ.get("TRACKING_SECRET", "").encode('utf-8')
+    or b"link-tracking:" + bytes.fromhex(os.environ['ENCRYPTION_KEY'])
+).digest()
+SIGNATURE_BYTES = 8
+
+# Pattern to find href attributes
+HREF_PATTERN = re.compile(r'href="(.*?)"')
+TOKEN_LINK_PATTERN = re.compile(r'/t/[0-9a-f]+\.[0-9a-f]+\.[\w-]+$')
+
+def is_trackable(url):
+    """Skip links that are already tracked and mailto links"""
+    if '/track/' in url or url.startswith('mailto:'):
+        return False
+    return not TOKEN_LINK_PATTERN.search(url)
+
+def extract_links(html_content):
+    """Return the trackable URLs in an email body, in link-index order"""
+    return [url for url in HREF_PATTERN.findall(html_content) if is_trackable(url)]
+
+def build_link_rows(queue_row):
+    """Rows for the tracked_links table for one email_queue row"""
+    return [
+        {
+            "email_queue_id": queue_row["id"],
+            "link_index": index,
+            "url": url,
+            "lead_id": queue_row["lead_id"],
+            "campaign_id": queue_row["campaign_id"]
+        }
+        for index, url in enumerate(extract_links(queue_row["body"]))
+    ]
+
+def _signature(payload):
+    digest = hmac.new(TRACKING_KEY, payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).rstrip(b"=").decode('ascii')
+
+def sign_token(email_queue_id, link_index):
+    """Compact token encoding (queue id, link index), e.g. '1f4.0.Xk2...'"""
+    payload = f"{int(email_queue_id):x}.{int(link_index):x}"
+    return f"{payload}.{_signature(payload)}"
+
+def verify_token(token):
+    """Return (email_queue_id, link_index) for a valid token, otherwise None"""
+    # compare_digest raises TypeError on non-ASCII str, and valid tokens are always ASCII
+    if not token.isascii():
+        return None
+    payload, _, signature = token.rpartition(".")
+    if not payload or not hmac.compare_digest(signature, _signature(payload)):
+        return None
+    try:
+        email_queue_id, link_index = (int(part, 16) for part in payload.split("."))
+    except ValueError:
+        return None
+    return email_queue_id, link_index
+
+def replace_urls_with_tracking(html_content, email_queue_id, app_base_url):
+    """Replace each trackable href with a signed /t/<token> link"""
+    link_index = 0
+
+    def replace_with_tracking(match):
+        nonlocal link_index
+        if not is_trackable(match.group(1)):
+            return match.group(0)
+        token = sign_token(email_queue_id, link_index)
+        link_index += 1
+        return f'href="{app_base_url}/t/{token}"'
+
+    return HREF_PATTERN.sub(replace_with_tracking, html_content)
+
+def replace_urls_with_legacy_tracking(html_content, lead_id, campaign_id, email_queue_id, app_base_url):
+    """Replace each trackable href with a legacy /track/<lead>/<campaign>?url=... link.
+
+    Used when an email's tracked_links rows couldn't be written, since its /t/ tokens
+    would not resolve.
+    """
+    def replace_with_tracking(match):
+        if not is_trackable(match.group(1)):
+            return match.group(0)
+        tracking_url = f"{app_base_url}/track/{lead_id}/{campaign_id}?url={urllib.parse.quote(match.group(1))}"
+        if email_queue_id:
+            tracking_url += f"&eqid={email_queue_id}"
+        return f'href="{tracking_url}"'
+
+    return HREF_PATTERN.sub(replace_with_tracking, html_content)
@@ -0,0 +1,39 @@
+# usage_buffer.py
+import os
+import threading
+from collections import Counter
+from flusher import PeriodicFlusher
+
+AI_USAGE_FLUSH_INTERVAL = float(os.environ.get("AI_USAGE_FLUSH_INTERVAL", 5))
+
+
+class UsageBuffer:
+    """Coalesces per-lead usage increments in memory and flushes them periodically.
+
+    flush receives a list of {"lead_id": ..., "count": ...} and is expected to apply it
+    in one round trip. Increments from a failed flush are merged back for the next try.
+    """
+
+    def __init__(self, flush, flush_interval=AI_USAGE_FLUSH_INTERVAL):
+        self.flush_fn = flush
+        self.flush_interval = flush_interval
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.flusher = PeriodicFlusher(self.flush, flush_interval, "usage-buffer")
+
+    def add(self, lead_id, count=1):
+        with self.lock:
+            self.counts[lead_id] += count
+        self.flusher.start()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        try:
+            self.flush_fn([{"lead_id": lead_id, "count": count} for lead_id, count in counts.items()])
+        except Exception as e:
+            print(f"Error flushing AI usage for {len(counts)} leads: {str(e)}")
+            with self.lock:
+                self.counts.update(counts)
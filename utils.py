@@ -1,33 +1,117 @@
 # utils.py
-from requests import post
 import os
+import json
+import time
+from http_client import post, request
+from ai_cache import ResponseCache
+from model_router import ModelRouter
 
-def callAIML_from_flask(prompt: str) -> str:
+SYSTEM_PROMPT = "You are a professional real estate agent."
+CHAT_PARAMS = {"temperature": 0.7, "top_p": 0.7, "max_tokens": 512}
+
+# Identical prompts to the same models reuse the previous completion
+response_cache = ResponseCache()
+
+def call_model(model: str, prompt: str, timeout: float) -> str:
     GITHUB_TOKEN = os.environ["GITHUB_TOKEN"]
-    MODELS = os.environ.get("GH_MODELS", "openai/gpt-4o-mini").split(",")
-    for model in MODELS:
-        resp = post(
-            "https://models.github.ai/inference/chat/completions",
-            headers={
-                "Authorization": f"Bearer {GITHUB_TOKEN}",
-                "Accept": "application/vnd.github+json",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": model.strip(),
-                "messages": [
-                    {"role": "system", "content": "You are a professional real estate agent."},
-                    {"role": "user",   "content": prompt}
-                ],
-                "temperature": 0.7,
-                "top_p": 0.7,
-                "max_tokens": 512
-            },
-            timeout=300
-        )
-        if resp.status_code == 200:
-            return resp.json()["choices"][0]["message"]["content"].strip()
-        if resp.status_code in (404, 429):
+    resp = post(
+        "https://models.github.ai/inference/chat/completions",
+        headers={
+            "Authorization": f"Bearer {GITHUB_TOKEN}",
+            "Accept": "application/vnd.github+json",
+            "Content-Type": "application/json"
+        },
+        json={
+            "model": model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user",   "content": prompt}
+            ],
+            **CHAT_PARAMS
+        },
+        read_timeout=timeout
+    )
+    resp.raise_for_status()
+    return resp.json()["choices"][0]["message"]["content"].strip()
+
+# Circuit breakers and latency stats are shared by every caller in the process
+model_router = ModelRouter(call_model)
+
+def complete(prompt: str, timeout: float = 300) -> str:
+    MODELS = [m.strip() for m in os.environ.get("GH_MODELS", "openai/gpt-4o-mini").split(",")]
+
+    cache_key = response_cache.key(prompt, models=MODELS, system=SYSTEM_PROMPT, **CHAT_PARAMS)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    content = model_router.complete(MODELS, prompt, timeout)
+    response_cache.set(cache_key, content)
+    return content
+
+def stream_completion(prompt: str, timeout: float = 300):
+    """Yield completion text as it arrives, using the first model whose breaker is closed"""
+    MODELS = [m.strip() for m in os.environ.get("GH_MODELS", "openai/gpt-4o-mini").split(",")]
+
+    cache_key = response_cache.key(prompt, models=MODELS, system=SYSTEM_PROMPT, **CHAT_PARAMS)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    GITHUB_TOKEN = os.environ["GITHUB_TOKEN"]
+    for model in model_router.available_models(MODELS):
+        started = time.monotonic()
+        try:
+            resp = request(
+                "POST",
+                "https://models.github.ai/inference/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {GITHUB_TOKEN}",
+                    "Accept": "text/event-stream",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user",   "content": prompt}
+                    ],
+                    "stream": True,
+                    **CHAT_PARAMS
+                },
+                stream=True,
+                read_timeout=timeout
+            )
+            resp.raise_for_status()
+        except Exception as e:
+            # Nothing has been sent yet, so fall back to the next model
+            model_router.record_failure(model, e)
+            print(f"Error with model {model}: {str(e)}")
             continue
-        resp.raise_for_status()
+
+        parts = []
+        try:
+            with resp:
+                # SSE is always UTF-8; requests would assume ISO-8859-1 without a charset
+                resp.encoding = "utf-8"
+                for line in resp.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or []
+                    text = choices[0].get("delta", {}).get("content") if choices else None
+                    if text:
+                        parts.append(text)
+                        yield text
+        except Exception as e:
+            model_router.record_failure(model, e)
+            raise
+
+        model_router.record_success(model, time.monotonic() - started)
+        response_cache.set(cache_key, "".join(parts).strip())
+        return
+
     raise RuntimeError("All models failed or were rate‑limited")
@@ -0,0 +1,112 @@
+# validation.py
+import os
+import re
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email_validator import validate_email, validate_email_deliverability, EmailNotValidError
+
+DOMAIN_CACHE_SIZE = int(os.environ.get("EMAIL_DOMAIN_CACHE_SIZE", 4096))
+# Rejections and inconclusive lookups are only trusted this long, so a DNS hiccup
+# doesn't keep failing a domain for the life of the process
+DOMAIN_NEGATIVE_TTL = float(os.environ.get("EMAIL_DOMAIN_NEGATIVE_TTL", 300))
+VALIDATION_CHUNK_SIZE = int(os.environ.get("EMAIL_VALIDATION_CHUNK_SIZE", 500))
+VALIDATION_WORKERS = int(os.environ.get("EMAIL_VALIDATION_WORKERS", os.cpu_count() or 1))
+
+# Cheap pre-check that rejects obvious junk before the full validator runs
+EMAIL_SYNTAX = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s.]+$")
+
+# ascii domain -> (expires_at or None for good domains, rejection reason or None)
+domain_cache = OrderedDict()
+domain_cache_lock = threading.Lock()
+
+def check_domain(ascii_domain, domain):
+    """Return None if the domain accepts mail, otherwise the rejection reason.
+
+    Domains that accept mail are cached until evicted. email-validator reports a DNS
+    failure (SERVFAIL, any resolver error) the same way as a missing domain, so
+    rejections and timed-out lookups are cached for DOMAIN_NEGATIVE_TTL seconds only.
+    """
+    now = time.monotonic()
+    with domain_cache_lock:
+        entry = domain_cache.get(ascii_domain)
+        if entry and (entry[0] is None or entry[0] > now):
+            domain_cache.move_to_end(ascii_domain)
+            return entry[1]
+
+    try:
+        info = validate_email_deliverability(ascii_domain, domain)
+        reason = None
+        expires_at = now + DOMAIN_NEGATIVE_TTL if info.get("unknown-deliverability") else None
+    except EmailNotValidError as e:
+        reason = str(e)
+        expires_at = now + DOMAIN_NEGATIVE_TTL
+
+    with domain_cache_lock:
+        domain_cache[ascii_domain] = (expires_at, reason)
+        domain_cache.move_to_end(ascii_domain)
+        while len(domain_cache) > DOMAIN_CACHE_SIZE:
+            domain_cache.popitem(last=False)
+    return reason
+
+def check_email(email):
+    """Return None for a valid address, otherwise the reason it was rejected"""
+    if not EMAIL_SYNTAX.match(email):
+        return "Invalid email syntax"
+    try:
+        valid = validate_email(email, check_deliverability=False)
+    except EmailNotValidError as e:
+        return str(e)
+    return check_domain(valid.ascii_domain, valid.domain)
+
+def check_emails(emails):
+    """Validate a chunk of addresses; this is what runs inside the process pool"""
+    return [check_email(email) for email in emails]
+
+def validate_emails(emails, executor=None, chunk_size=VALIDATION_CHUNK_SIZE):
+    """Return a rejection reason (or None) for each address, in order.
+
+    Small inputs are checked inline; larger ones are split into chunks and spread
+    across the given executor.
+    """
+    if executor is None or len(emails) <= chunk_size:
+        return check_emails(emails)
+
+    chunks = [emails[i:i+chunk_size] for i in range(0, len(emails), chunk_size)]
+    results = []
+    try:
+        for chunk_results in executor.map(check_emails, chunks):
+            results.extend(chunk_results)
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool next time and finish this window inline
+        reset_validation_pool(executor)
+        return check_emails(emails)
+    return results
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_validation_pool():
+    """Shared validation pool, kept across imports so each worker's check_domain cache stays warm.
+
+    Spawned (not forked) since the web worker is threaded.
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=VALIDATION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return pool
+
+def reset_validation_pool(broken):
+    """Replace the broken executor, unless another caller already has; never touches a newer pool"""
+    global pool
+    with pool_lock:
+        if pool is broken:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
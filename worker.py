@@ -6,8 +6,7 @@ from email.mime.text import MIMEText
 from datetime import datetime, timedelta, date, timezone
 from supabase import create_client
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-import urllib.parse
-import re
+from tracking import build_link_rows, replace_urls_with_tracking, replace_urls_with_legacy_tracking
 
 # Initialize Supabase
 SUPABASE_URL = os.environ['SUPABASE_URL']
@@ -25,6 +24,13 @@ def aesgcm_decrypt(b64text: str) -> str:
     pt = aesgcm.decrypt(nonce, ct, None)
     return pt.decode('utf-8')
 
+def smtp_timeout(account):
+    """Socket timeout for an account, scaled from the handshake latency measured at verification"""
+    latency_ms = account.get("smtp_latency_ms")
+    if not latency_ms:
+        return 30
+    return min(60, max(10, latency_ms * 5 / 1000))
+
 def send_email_via_smtp(account, to_email, subject, html_body):
     """Send email using SMTP"""
     try:
@@ -38,7 +44,7 @@ def send_email_via_smtp(account, to_email, subject, html_body):
         msg["To"] = to_email
         
         # Send email
-        smtp = smtplib.SMTP(account["smtp_host"], account["smtp_port"])
+        smtp = smtplib.SMTP(account["smtp_host"], account["smtp_port"], timeout=smtp_timeout(account))
         smtp.starttls()  # Use TLS
         smtp.login(account["smtp_username"], smtp_password)
         smtp.send_message(msg)
@@ -87,6 +93,12 @@ def get_all_accounts_with_capacity():
     
     accounts_with_capacity = []
     for account in accounts.data:
+        # Skip accounts whose credentials failed or haven't been verified yet
+        if account.get("verification_status") in ("failed", "pending_verification"):
+            print(f"Skipping {account['email']}: verification {account['verification_status']} "
+                  f"(re-run with POST /api/smtp-accounts/{account['id']}/verify)")
+            continue
+
         # Get today's count for this account
         count_data = supabase.table("daily_email_counts") \
             .select("count") \
@@ -182,6 +194,10 @@ def send_queued():
         return
         
     print(f"Found {len(available_accounts)} accounts with capacity")
+
+    # Get the base URL for tracking links from environment variable
+    app_base_url = os.environ.get('APP_BASE_URL', 'https://tha-clone-of-admin.onrender.com')
+    tracked_ids = ensure_tracked_links(queued.data)
     
     sent_count = 0
     failed_count = 0
@@ -223,12 +239,17 @@ def send_queued():
             assign_account_to_lead_campaign(q["lead_id"], q["campaign_id"], account["email"])
         
         try:
-            tracked_body = replace_urls_with_tracking(
-                 q["body"], 
-                 q["lead_id"], 
-                 q["campaign_id"],
-                 q["id"]  # email_queue_id
-            )
+            if q["id"] in tracked_ids:
+                tracked_body = replace_urls_with_tracking(
+                     q["body"], 
+                     q["id"],  # email_queue_id
+                     app_base_url
+                )
+            else:
+                # Its link rows are missing, so /t/ tokens would 404; use the legacy links
+                tracked_body = replace_urls_with_legacy_tracking(
+                    q["body"], q["lead_id"], q["campaign_id"], q["id"], app_base_url
+                )
 
             success = send_email_via_smtp(
                 account=account,
@@ -312,7 +333,7 @@ def schedule_followup(q, sequence, account_email):
             rendered_body = render_email_template(follow_up["body"], lead.data)
             
             # Queue follow-up with the same account
-            supabase.table("email_queue").insert({
+            queued = supabase.table("email_queue").insert({
                 "campaign_id": q["campaign_id"],
                 "lead_id": q["lead_id"],
                 "lead_email": q["lead_email"],
@@ -321,6 +342,11 @@ def schedule_followup(q, sequence, account_email):
                 "sequence": sequence,
                 "scheduled_for": send_date.isoformat()
             }).execute()
+
+            # Build the link table for the queued follow-up
+            link_rows = build_link_rows(queued.data[0])
+            if link_rows:
+                supabase.table("tracked_links").upsert(link_rows, on_conflict="email_queue_id,link_index").execute()
     except Exception as e:
         print(f"Error scheduling follow-up: {str(e)}")
 
@@ -339,37 +365,36 @@ def render_email_template(template, lead_data):
     
     return rendered
 
-def replace_urls_with_tracking(html_content, lead_id, campaign_id, email_queue_id=None):
-    """
-    Replace all URLs in HTML content with tracking URLs
+def ensure_tracked_links(queued_rows):
+    """Backfill tracked_links rows for queued emails that were queued without them.
+
+    Returns the ids of the emails whose /t/ tokens will resolve: those with link rows
+    in the table, plus those with no trackable links at all.
     """
-    # Get the base URL from environment variable
-    app_base_url = os.environ.get('APP_BASE_URL', 'https://tha-clone-of-admin.onrender.com')
-    
-    # Pattern to find href attributes
-    pattern = r'href="(.*?)"'
-    
-    def replace_with_tracking(match):
-        original_url = match.group(1)
-        
-        # Skip if it's already a tracking link or mailto link
-        if '/track/' in original_url or original_url.startswith('mailto:'):
-            return match.group(0)
-            
-        # Encode the original URL
-        encoded_url = urllib.parse.quote(original_url)
-        
-        # Build tracking URL
-        tracking_url = f"{app_base_url}/track/{lead_id}/{campaign_id}?url={encoded_url}"
-        
-        # Add email_queue_id if available
-        if email_queue_id:
-            tracking_url += f"&eqid={email_queue_id}"
-            
-        return f'href="{tracking_url}"'
-    
-    # Replace all URLs
-    return re.sub(pattern, replace_with_tracking, html_content)
+    ids = [q["id"] for q in queued_rows]
+    rows_by_id = {q["id"]: build_link_rows(q) for q in queued_rows}
+    no_links = {email_id for email_id, rows in rows_by_id.items() if not rows}
+    try:
+        existing = supabase.table("tracked_links") \
+            .select("email_queue_id") \
+            .in_("email_queue_id", ids) \
+            .execute()
+    except Exception as e:
+        print(f"Error checking tracked links: {str(e)}")
+        return no_links
+    have_links = {row["email_queue_id"] for row in existing.data}
+
+    link_rows = []
+    for email_id, rows in rows_by_id.items():
+        if email_id not in have_links:
+            link_rows.extend(rows)
+    if link_rows:
+        try:
+            supabase.table("tracked_links").upsert(link_rows, on_conflict="email_queue_id,link_index").execute()
+        except Exception as e:
+            print(f"Error building tracked links: {str(e)}")
+            return have_links | no_links
+    return set(ids)
 
 if __name__ == "__main__":
     send_queued()